@@ -14,16 +14,242 @@
 
 import myask_log
 import re
+import json
+import time
+import argparse
+from json.encoder import encode_basestring_ascii
 from sre_compile import isstring
 from datetime import date
 
-def createAlexaErrorOutput(error_msg, slots):
+#-------------------------------------------------------------------------------
+# response skeletons for the JSON serializer, one per response shape
+# (show_card, use_reprompt): (format string, names of the variable fields)
+# The variable fields are inserted as JSON encoded values
+#-------------------------------------------------------------------------------
+def _build_skeleton(show_card, use_reprompt):
+    template = '{"version":"1.0","sessionAttributes":%s,"response":{"outputSpeech":{"type":"SSML","ssml":%s}'
+    fields = ["session_attributes", "ssml"]
+    if show_card:
+        template += ',"card":{"type":"Simple","title":%s,"content":%s}'
+        fields += ["card_title", "card_text"]
+    if use_reprompt:
+        template += ',"reprompt":{"outputSpeech":{"type":"PlainText","text":%s}}'
+        fields += ["reprompt_text"]
+    template += ',"shouldEndSession":%s}}'
+    fields += ["should_end_session"]
+    return (template, tuple(fields))
+
+RESPONSE_SKELETONS = {}
+for _card in [True, False]:
+    for _reprompt in [True, False]:
+        RESPONSE_SKELETONS[(_card, _reprompt)] = _build_skeleton(_card, _reprompt)
+
+# serialized static responses (no session attributes), e.g. help, stop or errors
+STATIC_RESPONSE_CACHE_SIZE = 256
+_static_response_cache = {}
+
+_encode_json = json.JSONEncoder(separators=(',', ':')).encode
+
+#-------------------------------------------------------------------------------
+# SSML -> card text
+# All SSML tags are removed, their content is kept (e.g. the written form 
+# inside <sub>, <phoneme>, <say-as>). <break>, </p> start a new line, 
+# </s> is replaced by a blank. XML entities are unescaped.
+#-------------------------------------------------------------------------------
+_SSML_TOKEN = re.compile(r'<(/?[A-Za-z][\w:.-]*)(?:[^>"\']|"[^"]*"|\'[^\']*\')*>|&(#x[0-9A-Fa-f]+|#[0-9]+|amp|lt|gt|quot|apos);')
+
+# tag ("/tag" for closing tags) -> card text. All other tags are removed
+SSML_CARD_TEXT = {
+    "break": "\n",
+    "/p":    "\n",
+    "/s":    " "
+}
+
+SSML_ENTITIES = {"amp": u"&", "lt": u"<", "gt": u">", "quot": u'"', "apos": u"'"}
+
+SSML_CARD_CACHE_SIZE = 512
+_ssml_card_cache = {}
+
+def _render_ssml_token(match):
+    tag = match.group(1)
+    if tag is not None:
+        return SSML_CARD_TEXT.get(tag, "")
+    entity = match.group(2)
+    if entity[0] != "#": return SSML_ENTITIES[entity]
+    try:
+        if entity[1] == "x": return unichr(int(entity[2:], 16))
+        else: return unichr(int(entity[1:]))
+    except ValueError: # out of range (or above 0xFFFF on narrow builds)
+        return unicode(match.group(0))
+
+def _render_ssml_token_utf8(match):
+    # same as _render_ssml_token for UTF-8 encoded byte strings
+    return _render_ssml_token(match).encode("utf-8")
+
+def SSMLToCardText(ssml):
+    #---------------------------------------------------------------------------
+    # converts SSML speech output to plain text for the card display
+    # (one scan over the text, results are cached)
+    #---------------------------------------------------------------------------
+    key = (type(ssml), ssml) # "abc" == u"abc", but the result keeps the type
+    cardtext = _ssml_card_cache.get(key)
+    if cardtext is None:
+        if isinstance(ssml, unicode): 
+            cardtext = _SSML_TOKEN.sub(_render_ssml_token, ssml)
+        else: 
+            cardtext = _SSML_TOKEN.sub(_render_ssml_token_utf8, ssml)
+        if len(_ssml_card_cache) >= SSML_CARD_CACHE_SIZE:
+            _ssml_card_cache.clear()
+        _ssml_card_cache[key] = cardtext
+    return cardtext
+
+def createAlexaErrorOutput(error_msg, slots, json_bytes=False):
     out = alexaout()
     out.speech_output = error_msg
     out.card_text = error_msg
 
+    if json_bytes: return out.createOutputJSON(slots)
     return out.createOutput(slots)
 
+#-------------------------------------------------------------------------------
+# SSML builder
+#-------------------------------------------------------------------------------
+# maximum length of the SSML output accepted by Alexa (incl. <speak></speak>)
+SSML_MAX_LENGTH = 8000
+
+def EscapeSSML(text):
+    # escapes XML special characters in plain text for SSML output
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+# tags (start, end or empty element), entities and blanks of an SSML text
+_SSML_SPLIT_TOKEN = re.compile(r'<(/?)([A-Za-z][\w:.-]*)(?:[^>"\']|"[^"]*"|\'[^\']*\')*?(/?)>|&#?\w+;| ')
+
+def _split_ssml(sentence, budget):
+    #---------------------------------------------------------------------------
+    # splits an SSML sentence into (head, rest) with len(head) <= budget
+    # The cut is at the last blank (or, without blank, the last character) 
+    # that fits, never inside a tag or entity. Elements open at the cut are 
+    # closed at the end of head and reopened at the start of rest.
+    # Returns None if not even the closing tags fit
+    #---------------------------------------------------------------------------
+    stack = []      # open elements: (name, start tag)
+    closelength = 0 # length of the end tags of all open elements
+    blankcut = None # (position, open elements)
+    textcut = None
+    pos = 0
+    for match in _SSML_SPLIT_TOKEN.finditer(sentence):
+        # text before the token can be cut anywhere
+        end = min(match.start(), budget - closelength)
+        if end >= pos and end > 0: textcut = (end, tuple(stack))
+        if match.start() + closelength > budget: break
+        if match.group(0) == " ":
+            blankcut = (match.start(), tuple(stack))
+        elif match.group(2) is not None and match.group(3) == "":
+            if match.group(1) == "": 
+                stack.append((match.group(2), match.group(0)))
+            else:
+                names = [name for (name, starttag) in stack]
+                if match.group(2) in names: 
+                    del stack[len(names) - 1 - names[::-1].index(match.group(2)):]
+            closelength = sum(len(name) + 3 for (name, starttag) in stack)
+        pos = match.end()
+    else:
+        end = min(len(sentence), budget - closelength)
+        if end >= pos and end > 0: textcut = (end, tuple(stack))
+    if blankcut is None: blankcut = textcut
+    if blankcut is None: return None
+    (cut, openelements) = blankcut
+    head = sentence[:cut] + "".join(["</"+name+">" for (name, starttag) in reversed(openelements)])
+    rest = "".join([starttag for (name, starttag) in openelements]) + sentence[cut:]
+    return (head, rest)
+
+class ssmlbuilder:
+    #----------------------------------------------------------------------
+    # builds the SSML speech output from fragments, within the size limit
+    # 'maxlength': maximum length of the output (without <speak></speak>)
+    # 'more_prompt': SSML added at the end if not all sentences fit
+    #                (e.g. "Soll ich weiterlesen?"). Its length is reserved
+    # Text is added to the current sentence with Add (plain text, escaped)
+    # or AddSSML (SSML fragments, unchanged). EndSentence completes the 
+    # sentence. If the sentence does not fit anymore, it and all following 
+    # sentences are kept in GetRemaining(), e.g. to be stored in the session
+    # and read out in the next turn with AddSSMLSentences.
+    #----------------------------------------------------------------------
+    def __init__(self, maxlength=SSML_MAX_LENGTH - len("<speak></speak>"), more_prompt=""):
+        self.maxlength = maxlength
+        self.more_prompt = more_prompt
+        self._fragments = []
+        self._length = 0
+        self._sentence = []
+        self._sentencelength = 0
+        self._remaining = []
+
+    def Add(self, text):
+        text = EscapeSSML(text)
+        self._sentence.append(text)
+        self._sentencelength += len(text)
+        return self
+
+    def AddSSML(self, fragment):
+        self._sentence.append(fragment)
+        self._sentencelength += len(fragment)
+        return self
+
+    def AddSentence(self, text):
+        return self.Add(text).EndSentence()
+
+    def AddSSMLSentences(self, sentences):
+        for sentence in sentences:
+            self.AddSSML(sentence).EndSentence()
+        return self
+
+    def EndSentence(self):
+        #------------------------------------------------------------------
+        # completes the current sentence. Returns False if it did not fit
+        #------------------------------------------------------------------
+        if self._sentencelength == 0: return True
+        sentence = "".join(self._sentence)
+        self._sentence = []
+        self._sentencelength = 0
+        if self._remaining:
+            self._remaining.append(sentence)
+            return False
+        if self._length + len(sentence) + len(self.more_prompt) <= self.maxlength:
+            self._fragments.append(sentence)
+            self._length += len(sentence)
+            return True
+        if self._length == 0:
+            # a single sentence exceeding the limit: split it, open elements
+            # are closed and continued in the remaining part
+            myask_log.warning("ssmlbuilder: sentence with "+str(len(sentence))+" characters exceeds the SSML limit, output split")
+            parts = _split_ssml(sentence, self.maxlength - len(self.more_prompt))
+            if parts is not None:
+                self._fragments.append(parts[0])
+                self._length += len(parts[0])
+                sentence = parts[1]
+        self._remaining.append(sentence)
+        return False
+
+    def IsTruncated(self):
+        return len(self._remaining) > 0
+
+    def GetRemaining(self):
+        # sentences which did not fit into the output (SSML)
+        self.EndSentence()
+        return self._remaining
+
+    def GetLength(self):
+        return self._length + self._sentencelength
+
+    def GetSSML(self):
+        #------------------------------------------------------------------
+        # returns the SSML output (without <speak></speak>)
+        #------------------------------------------------------------------
+        self.EndSentence()
+        if self._remaining: 
+            return "".join(self._fragments) + self.more_prompt
+        return "".join(self._fragments)
+
 class alexaout:
     #----------------------------------------------------------------------
     # Creates properly formated output JSON structure from parameters
@@ -34,6 +260,7 @@ class alexaout:
     # 'should_end_session' if False, Alexa is instructed to continue the session
     # 'session_attributes' key-value pairs to be returned in next utterance
     # 'slots' current set of slots (output if debuglevel >3)
+    # 'show_card' / 'use_reprompt': if False, the card / reprompt is omitted
     #----------------------------------------------------------------------
     def __init__(self):
         self.session_attributes = {}
@@ -43,45 +270,85 @@ class alexaout:
         self.speech_output = ""
         self.reprompt_text = ""
         self.card_text = "" 
+        self.show_card = True
+        self.use_reprompt = True
     
     def DisplaySpeechOutputOnCard(self):
-        ssmltext = self.speech_output
-        self.card_text = ssmltext
-        self.card_text = re.sub('<break[^/]*/>','\n', self.card_text) 
-        self.card_text = self.card_text.replace('<p>','') 
-        self.card_text = self.card_text.replace('</p>','\n') 
-        self.card_text = self.card_text.replace('</say-as>','') 
-        self.card_text = re.sub(r'<say-as[^>]*>','', self.card_text) 
+        self.card_text = SSMLToCardText(self.speech_output)
         
-    def createOutput(self, slots, session_attributes={}):
+    def _prepareCard(self, slots):
+        if not self.show_card: return
         if(self.card_text == ""):
             self.DisplaySpeechOutputOnCard()
         if myask_log.show_debugslots == True:
             self.card_text = self.printcardslots(slots) + "\n" + self.card_text
-    
+
+    @myask_log.timed("alexaout.createOutput")
+    def createOutput(self, slots, session_attributes={}):
+        self._prepareCard(slots)
         speechlet_response = self.build_speechlet_response()
         return self.build_response(session_attributes, speechlet_response)
 
+    @myask_log.timed("alexaout.createOutputJSON")
+    def createOutputJSON(self, slots, session_attributes={}):
+        #----------------------------------------------------------------------
+        # same as createOutput, but returns the response as UTF-8 encoded 
+        # JSON string, for hosts that return the raw response body.
+        # The response is created from the prebuilt skeleton for its shape.
+        # Responses without session attributes are cached.
+        #----------------------------------------------------------------------
+        self._prepareCard(slots)
+        shape = (self.show_card, self.use_reprompt)
+        if session_attributes: 
+            return self._serialize(shape, session_attributes)
+
+        key = (shape, self.speech_output, self.card_title, self.card_text, self.reprompt_text, self.should_end_session)
+        result = _static_response_cache.get(key)
+        if result is None:
+            if len(_static_response_cache) >= STATIC_RESPONSE_CACHE_SIZE:
+                _static_response_cache.clear()
+            result = self._serialize(shape, session_attributes)
+            _static_response_cache[key] = result
+        return result
+
+    def _serialize(self, shape, session_attributes):
+        (template, fields) = RESPONSE_SKELETONS[shape]
+        values = []
+        for field in fields:
+            if field == "session_attributes":
+                values.append(_encode_json(session_attributes))
+            elif field == "ssml":
+                values.append(encode_basestring_ascii("<speak>"+self.speech_output+"</speak>"))
+            elif field == "should_end_session":
+                if self.should_end_session: values.append("true")
+                else: values.append("false")
+            else:
+                values.append(encode_basestring_ascii(getattr(self, field)))
+        return template % tuple(values)
+
     def build_speechlet_response(self):
         speech_output = "<speak>"+self.speech_output+"</speak>"
-        return {
+        response = {
             'outputSpeech': {
                 'type': 'SSML',
                 'ssml': speech_output
             },
-            'card': {
+            'shouldEndSession': self.should_end_session
+            }
+        if self.show_card:
+            response['card'] = {
                 'type': 'Simple',
                 'title':  self.card_title,
                 'content': self.card_text
-            },
-            'reprompt': {
+            }
+        if self.use_reprompt:
+            response['reprompt'] = {
                 'outputSpeech': {
                     'type': 'PlainText',
                     'text': self.reprompt_text
                 }
-            },
-            'shouldEndSession': self.should_end_session
             }
+        return response
         
 
 
@@ -121,7 +388,53 @@ class alexaout:
         output += u"-------------\n"
         return output    
 
+def RunBenchmark(numresponses=100000):
+    #--------------------------------------------------------------------------
+    # prints the number of responses per second for 
+    # - createOutput + json.dumps (current path of most hosts)
+    # - createOutputJSON for a static response (cached)
+    # - createOutputJSON with session attributes (skeleton only)
+    #--------------------------------------------------------------------------
+    speech = u"Das habe ich leider nicht verstanden.<break time=\"1s\"/>Sage zum Beispiel <p>welche Farbe hat der Himmel</p>"
+    attributes = {"prev_intent": "TellColor", "Color": "C:BLUE|blau"}
+
+    def create():
+        out = alexaout()
+        out.speech_output = speech
+        out.card_title = "Farben"
+        out.reprompt_text = u"Welche Farbe möchtest Du?"
+        out.should_end_session = False
+        return out
+
+    if json.loads(create().createOutputJSON({}, attributes)) != create().createOutput({}, attributes):
+        myask_log.error("RunBenchmark: createOutputJSON differs from createOutput")
+    # card text of UTF-8 byte strings and unicode prompts
+    for (ssml, cardtext) in [("K\xc3\xb6ln &amp; Bonn<break/>&#228;", "K\xc3\xb6ln & Bonn\n\xc3\xa4"),
+                             (u"K\xf6ln &amp; Bonn<break/>&#228;", u"K\xf6ln & Bonn\n\xe4"),
+                             ("abc", "abc"), (u"abc", u"abc"), (u"x&#99999999;", u"x&#99999999;")]:
+        result = SSMLToCardText(ssml)
+        if result != cardtext or type(result) != type(cardtext):
+            myask_log.error("RunBenchmark: SSMLToCardText(%r) returned %r", ssml, result)
+
+    tests = [("createOutput + json.dumps        ", lambda: json.dumps(create().createOutput({}, attributes))),
+             ("createOutputJSON (static)        ", lambda: create().createOutputJSON({})),
+             ("createOutputJSON (with attributes)", lambda: create().createOutputJSON({}, attributes))]
+    print("Responses per second (" + str(numresponses) + " responses):")
+    for (name, function) in tests:
+        start = time.time()
+        for i in xrange(numresponses):
+            function()
+        duration = time.time() - start
+        print("  "+name+": {:10.0f}".format(numresponses / duration))
+
 def main():
-    myask_log.error("This module does not offer command line functionality")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-benchmark", "--benchmark", type=int, 
+                        help="measure the responses per second for the given number of responses")
+    args = parser.parse_args()    
+    if args.benchmark:
+        RunBenchmark(args.benchmark)
+    else:
+        myask_log.error("No option given, see -h for the command line options")
 if __name__ == "__main__":
     main()    
\ No newline at end of file
@@ -25,22 +25,668 @@
 ################################################################################
 
 import argparse
+import json
+import os
+import shutil
+import tempfile
+import ast
+import imp
 
 import random
-from datetime import datetime
+import hashlib
+import sys
+import time
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from StringIO import StringIO
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 import myask_log
+import myask_speech
+
+# version of the compiled appdef format written by SaveCompiled.
+# Must be increased whenever the internal data of applicationdef changes
+COMPILED_FORMAT = 6
+
+# locale of the literals in SLOTTYPES
+DEFAULT_LOCALE = "de-DE"
+
+# default limits for approximate matching (GetSlotCanonicalFuzzy)
+FUZZY_BUDGET_MS = 20
+FUZZY_MAX_CANDIDATES = 50
+FUZZY_MAX_POSTINGS = 5000
+
+# serializes the loading of lazy slot types (see applicationdef._materialize)
+_materialize_lock = threading.RLock()
+
+# sample values for built-in slot types in random test events
+RANDOM_DE_REGIONS = ("nrw", "bayern")
+RANDOM_DE_FIRST_NAMES = ("Katharina", "Konstantin", "Karina", "?", "friedhelm")
+
+def GetSourceHash(sourcefiles):
+    #--------------------------------------------------------------------------
+    # returns a hash (hex string) over the content of one or more source files
+    # 'sourcefiles' : filename or list of filenames 
+    #                 (application definition + imported slot lists)
+    #--------------------------------------------------------------------------
+    if isinstance(sourcefiles, basestring):
+        sourcefiles = [sourcefiles]
+    sourcehash = hashlib.sha1()
+    for filename in sourcefiles:
+        with open(filename, 'rb') as sourcefile:
+            sourcehash.update(sourcefile.read())
+    return sourcehash.hexdigest()
+
+def _get_module_file(modulename):
+    #--------------------------------------------------------------------------
+    # returns the source file (.py) of module 'modulename', None if unknown
+    # modules which are not imported yet are searched without importing them
+    #--------------------------------------------------------------------------
+    module = sys.modules.get(modulename)
+    if module is not None:
+        filename = getattr(module, "__file__", None)
+    elif "." not in modulename:
+        try:
+            (fileobj, filename, description) = imp.find_module(modulename)
+        except ImportError:
+            return None
+        if fileobj is not None: fileobj.close()
+    else:
+        try:
+            __import__(modulename)
+        except ImportError:
+            return None
+        filename = getattr(sys.modules[modulename], "__file__", None)
+    if filename is None: return None
+    if filename.endswith((".pyc", ".pyo")) and os.path.exists(filename[:-1]):
+        filename = filename[:-1]
+    return filename
+
+def _is_externalslottype(values):
+    # (also for instances created by "import myask_appdef" while this module 
+    #  runs as __main__)
+    return callable(values) and hasattr(values, "modulename") and hasattr(values, "attributename")
+
+def _get_local_imports(appdef_module):
+    #--------------------------------------------------------------------------
+    # returns the names of the modules imported by the appdef module 
+    # from its own directory (e.g. slot lists)
+    #--------------------------------------------------------------------------
+    appdeffile = _get_module_file(appdef_module.__name__)
+    appdefdir = os.path.dirname(os.path.abspath(appdeffile))
+    with open(appdeffile, 'rb') as sourcein:
+        tree = ast.parse(sourcein.read(), appdeffile)
+    modulenames = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modulenames.extend([alias.name for alias in node.names])
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            modulenames.append(node.module)
+    result = []
+    for modulename in modulenames:
+        filename = _get_module_file(modulename)
+        if filename and os.path.abspath(filename).startswith(appdefdir + os.sep) and modulename not in result:
+            result.append(modulename)
+    return result
+
+def _get_external_modules(appdef_module):
+    # names of the modules of the externalslottype declarations of an appdef module
+    result = []
+    slottypesets = [getattr(appdef_module, "SLOTTYPES", {})] + getattr(appdef_module, "LOCALESLOTTYPES", {}).values()
+    for slottypes in slottypesets:
+        for values in slottypes.values():
+            if _is_externalslottype(values) and values.modulename not in result:
+                result.append(values.modulename)
+    return result
+
+def GetAppDefSourceFiles(appdef_module):
+    #--------------------------------------------------------------------------
+    # returns the source files of an application definition module:
+    # the module itself, the modules it imports from its own directory 
+    # (e.g. slot lists) and the modules of its externalslottype declarations
+    #--------------------------------------------------------------------------
+    sourcefiles = [_get_module_file(appdef_module.__name__)]
+    for modulename in _get_local_imports(appdef_module) + _get_external_modules(appdef_module):
+        filename = _get_module_file(modulename)
+        if filename: sourcefiles.append(filename)
+    result = []
+    for filename in sourcefiles:
+        if filename not in result: result.append(filename)
+    return result
+
+class externalslottype:
+    #--------------------------------------------------------------------------
+    # Declares a custom slot type whose values are stored in a separate module
+    # The module is only imported when the slot type is used for the first time
+    # Example (in SLOTTYPES of the appdef file):
+    #   "LIST_OF_STATIONS" : externalslottype("stationlist", "STATIONS")
+    # Any other callable returning a [[canonical, [literals]], ...] list
+    # can be used in SLOTTYPES as well to declare a lazily loaded slot type
+    #--------------------------------------------------------------------------
+    def __init__(self, modulename, attributename):
+        self.modulename = modulename
+        self.attributename = attributename
+
+    def __call__(self):
+        module = __import__(self.modulename)
+        return getattr(module, self.attributename)
+
+class compactslottype:
+    #--------------------------------------------------------------------------
+    # Memory-saving read-only storage for a very large custom slot type
+    # 
+    # Instead of a list of lists of unicode strings plus dict indexes, 
+    # the slot type is stored as
+    #  - a tuple of (interned) canonicals, canonicals are referenced by their id
+    #  - one UTF-8 buffer with all literals, grouped by canonical 
+    #    + array of offsets into the buffer + array with the first literal per canonical
+    #  - one UTF-8 buffer with the sorted, lower-cased literals 
+    #    + array of offsets + array of canonical ids (binary search lookup)
+    #  - an array of canonical ids sorted by lower-cased canonical (binary search)
+    # The object can be used like the [[canonical, [literals]], ...] list 
+    # (len, index, iteration), entries are created on demand.
+    # Canonicals must be unique, ignoring upper/lower case.
+    # Used by applicationdef for all slot types listed in 'compactslottypes'
+    #--------------------------------------------------------------------------
+    def __init__(self, values, pronlex={}):
+        self._pronlex = pronlex
+        canonicals = []
+        literals = []
+        canonstart = [0]
+        keys = []
+        for entry in values:
+            if len(entry) < 2: 
+                myask_log.error("compactslottype: incorrect format for dictionary entry '"+str(entry)+"'")
+                continue
+            canonical = entry[0]
+            if isinstance(canonical, str): canonical = intern(canonical)
+            canonicalid = len(canonicals)
+            canonicals.append(canonical)
+            for literal in entry[1]:
+                literals.append(literal)
+                keys.append((literal.lower().encode("utf-8"), len(keys), canonicalid))
+            canonstart.append(len(literals))
+        self._canonicals = tuple(canonicals)
+        if len(canonicals) < 65536: idtype = 'H'
+        else: idtype = 'I'
+        self._sortedcanonicals = array(idtype, sorted(xrange(len(canonicals)), key=lambda i: str(canonicals[i]).lower()))
+
+        (self._litbuf, self._litoffsets) = self._pack([literal.encode("utf-8") for literal in literals])
+        self._canonstart = array('I', canonstart)
+
+        # sort by key, for duplicate keys the first literal wins
+        keys.sort()
+        sortedkeys = []
+        keycanon = array(idtype)
+        for (key, order, canonicalid) in keys:
+            if len(sortedkeys) > 0 and sortedkeys[-1] == key:
+                continue
+            sortedkeys.append(key)
+            keycanon.append(canonicalid)
+        (self._keybuf, self._keyoffsets) = self._pack(sortedkeys)
+        self._keycanon = keycanon
+        self._numkeys = len(sortedkeys)
+
+    def _pack(self, strings):
+        # joins byte strings into one buffer, returns (buffer, offsets)
+        offsets = array('I', [0])
+        position = 0
+        for string in strings:
+            position += len(string)
+            offsets.append(position)
+        return ("".join(strings), offsets)
+
+    def _key(self, i):
+        return self._keybuf[self._keyoffsets[i]:self._keyoffsets[i+1]]
+
+    def _literal(self, i):
+        return self._litbuf[self._litoffsets[i]:self._litoffsets[i+1]].decode("utf-8")
+
+    def _literals(self, canonicalid):
+        return tuple(self._literal(i) for i in xrange(self._canonstart[canonicalid], self._canonstart[canonicalid+1]))
+
+    def FindCanonical(self, literal):
+        #-----------------------------------------------------------------------      
+        # Returns: canonical for the (lower-cased) literal, None if not found
+        #-----------------------------------------------------------------------
+        key = literal.encode("utf-8")
+        (low, high) = (0, self._numkeys)
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key: low = middle + 1
+            else: high = middle
+        if low < self._numkeys and self._key(low) == key:
+            return self._canonicals[self._keycanon[low]]
+        return None
+
+    def FindRecord(self, canonical, ignorecase):
+        #-----------------------------------------------------------------------      
+        # Returns: (output name, spoken output name, literals) for a canonical
+        #          None if not found
+        #-----------------------------------------------------------------------
+        key = str(canonical).lower()
+        (low, high) = (0, len(self._sortedcanonicals))
+        while low < high:
+            middle = (low + high) // 2
+            if str(self._canonicals[self._sortedcanonicals[middle]]).lower() < key: low = middle + 1
+            else: high = middle
+        if low == len(self._sortedcanonicals):
+            return None
+        canonicalid = self._sortedcanonicals[low]
+        if str(self._canonicals[canonicalid]).lower() != key:
+            return None
+        if not ignorecase and self._canonicals[canonicalid] != canonical:
+            return None
+        literals = self._literals(canonicalid)
+        if len(literals) > 0: outputname = literals[0]
+        else: outputname = self._canonicals[canonicalid]
+        return (outputname, self._pronlex.get(outputname, outputname), literals)
+
+    def __len__(self):
+        return len(self._canonicals)
+
+    def __getitem__(self, canonicalid):
+        return [self._canonicals[canonicalid], list(self._literals(canonicalid))]
+
+    def __iter__(self):
+        for canonicalid in xrange(len(self._canonicals)):
+            yield self[canonicalid]
+
+class _compactview:
+    #--------------------------------------------------------------------------
+    # dict-like read-only view on a compactslottype, so that it can be used
+    # in place of the literal and canonical indexes of applicationdef
+    # kind: "literal", "canonical" or "canonical_lc"
+    #--------------------------------------------------------------------------
+    def __init__(self, store, kind):
+        self._store = store
+        self._kind = kind
+
+    def get(self, key, default=None):
+        if self._kind == "literal": value = self._store.FindCanonical(key)
+        else: value = self._store.FindRecord(key, self._kind == "canonical_lc")
+        if value is None: return default
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None: raise KeyError(key)
+        return value
+
+class _fuzzyindex:
+    #--------------------------------------------------------------------------
+    # approximate match index for one custom slot type, used by 
+    # applicationdef.GetSlotCanonicalFuzzy
+    #  - phonetic index: "Kölner Phonetik" code -> ids of literals with this code
+    #  - bigram index: character bigram -> ids of literals containing it,
+    #    used to select the candidates for the edit distance calculation
+    #--------------------------------------------------------------------------
+    def __init__(self, values):
+        self._literals = []
+        self._canonicals = []
+        self._codes = []
+        self._phonetic = {}
+        self._bigrams = {}
+        for entry in values:
+            if len(entry) < 2: 
+                continue
+            for literal in entry[1]:
+                literalid = len(self._literals)
+                literal = literal.lower()
+                code = myask_speech.encode_cgnph(literal)
+                self._literals.append(literal)
+                self._canonicals.append(entry[0])
+                self._codes.append(code)
+                self._phonetic.setdefault(code, []).append(literalid)
+                for bigram in self._get_bigrams(literal):
+                    if bigram not in self._bigrams:
+                        self._bigrams[bigram] = array('I')
+                    self._bigrams[bigram].append(literalid)
+
+    def _get_bigrams(self, literal):
+        padded = " "+literal+" "
+        return set(padded[i:i+2] for i in xrange(len(padded)-1))
+
+    def _get_candidates(self, literal, code, maxcandidates):
+        # literals with the same phonetic code first (unless there are more 
+        # than maxcandidates of them), then the literals sharing most bigrams. 
+        # The posting lists are counted from the rarest bigram on, until 
+        # FUZZY_MAX_POSTINGS postings are counted (the rarest list is always 
+        # counted). The remaining frequent bigrams are only checked for the 
+        # best literals so far, i.e. at most one bigram less than the best
+        # literal (binary search in the sorted posting list)
+        candidates = self._phonetic.get(code, [])
+        if len(candidates) > maxcandidates: candidates = []
+        else: candidates = list(candidates)
+        postinglists = []
+        for bigram in self._get_bigrams(literal):
+            postings = self._bigrams.get(bigram)
+            if postings is not None:
+                postinglists.append(postings)
+        postinglists.sort(key=len)
+        counts = {}
+        numcounted = 0
+        frequent = []
+        for postings in postinglists:
+            if numcounted > 0 and numcounted + len(postings) > FUZZY_MAX_POSTINGS:
+                frequent.append(postings)
+                continue
+            numcounted += len(postings)
+            for literalid in postings:
+                counts[literalid] = counts.get(literalid, 0) + 1
+        for postings in frequent:
+            maxcount = max(counts.itervalues())
+            for literalid in [l for l in counts if counts[l] >= maxcount - 1]:
+                position = bisect_left(postings, literalid)
+                if position < len(postings) and postings[position] == literalid:
+                    counts[literalid] += 1
+        # most shared bigrams first, equal counts: most similar length first
+        length = len(literal)
+        literals = self._literals
+        ranked = sorted(counts, key=lambda l: (-counts[l], abs(len(literals[l]) - length)))
+        for literalid in ranked[:maxcandidates]:
+            if literalid not in candidates:
+                candidates.append(literalid)
+        return candidates
+
+    def Find(self, literal, budget_ms, maxcandidates):
+        #-----------------------------------------------------------------------
+        # Returns: (canonical, confidence) of the best approximate match
+        #          ("?", 0.0) if no candidate was found
+        # confidence (0..1) combines the orthographic and phonetic edit distance
+        # The search stops when 'budget_ms' milliseconds are exceeded
+        #-----------------------------------------------------------------------
+        deadline = time.time() + budget_ms / 1000.0
+        literal = literal.lower()
+        code = myask_speech.encode_cgnph(literal)
+        best = ("?", 0.0)
+        for literalid in self._get_candidates(literal, code, maxcandidates):
+            candidate = self._literals[literalid]
+            candidatecode = self._codes[literalid]
+            orthographic = 1.0 - float(myask_speech.levenshtein(literal, candidate)) / max(len(literal), len(candidate), 1)
+            phonetic = 1.0 - float(myask_speech.levenshtein(code, candidatecode)) / max(len(code), len(candidatecode), 1)
+            confidence = 0.7 * orthographic + 0.3 * phonetic
+            if confidence > best[1]:
+                best = (self._canonicals[literalid], confidence)
+            if time.time() > deadline:
+                myask_log.debug(5, "_fuzzyindex.Find: time budget exceeded for '"+literal+"'")
+                break
+        return best
 
 class applicationdef:
-    def __init__(self, applicationname, applicationid, intentdef, slotdefinitions, slottypedefs, pronlex={}):
+    def __init__(self, applicationname, applicationid, intentdef, slotdefinitions, slottypedefs, pronlex={}, compactslottypes=[], fuzzymatching=False,
+                 localeslottypes={}, defaultlocale=DEFAULT_LOCALE):
         self._intentdef = intentdef 
         self._applicationname = applicationname
         self._applicationid = applicationid
         self._slotdefinitions = slotdefinitions
-        self._slottypedefs = slottypedefs
+        self._slottypedefs = dict(slottypedefs)
         self._pronlex = pronlex 
+        self._compactslottypes = set(compactslottypes)
+        self._fuzzymatching = fuzzymatching
+        # literals for other locales: locale -> {slottype: [[canonical, [literals]], ...]}
+        # The canonicals are the same in all locales. Slot types not listed
+        # for a locale use the literals of the default locale
+        self._defaultlocale = defaultlocale
+        self._localeslottypes = dict((locale, dict(localeslottypes[locale])) for locale in localeslottypes)
+        self._locales = set(self._localeslottypes.keys())
+        self._locales.add(defaultlocale)
+        self._localeindexes = {}
+        # modules of externalslottype declarations (source files of SaveCompiled)
+        self._externalmodules = set()
+        for slottypes in [self._slottypedefs] + self._localeslottypes.values():
+            for values in slottypes.values():
+                if _is_externalslottype(values):
+                    self._externalmodules.add(values.modulename)
         self._slotnames = []
         for slotname in self._slotdefinitions:
             self._slotnames.append(slotname)
+        # one literal index and one canonical index per slot type, 
+        # shared by all slots of that type
+        # Slot types declared as callable (e.g. externalslottype) are loaded 
+        # and indexed the first time they are used (see _materialize)
+        self._literalindex = {}
+        self._canonicalindex = {}
+        self._canonicalindex_lc = {}
+        # approximate match indexes (slottype, locale) -> _fuzzyindex, 
+        # built on first use (see _get_fuzzyindex) or by Prepare
+        self._fuzzyindex = {}
+        self._pendingslottypes = {}
+        for slottype in self._slottypedefs:
+            if callable(self._slottypedefs[slottype]):
+                self._pendingslottypes[slottype] = self._slottypedefs[slottype]
+            else:
+                self._build_indexes(slottype)
+
+    def _build_indexes(self, slottype):
+        #-----------------------------------------------------------------------      
+        # Private  member function of class applicationslots
+        # builds all lookup indexes for the slot type 'slottype'
+        # for compact slot types, the values are replaced by a compactslottype
+        #-----------------------------------------------------------------------
+        if slottype in self._compactslottypes and not isinstance(self._slottypedefs[slottype], compactslottype):
+            self._slottypedefs[slottype] = compactslottype(self._slottypedefs[slottype], self._pronlex)
+        (self._literalindex[slottype], self._canonicalindex[slottype], self._canonicalindex_lc[slottype]) = \
+            self._make_indexes(slottype, self._slottypedefs[slottype])
+
+    def _make_indexes(self, slottype, values):
+        #-----------------------------------------------------------------------      
+        # Private  member function of class applicationslots
+        # Returns: (literal index, canonical index, lower-cased canonical index)
+        #          for the [[canonical, [literals]], ...] list or compactslottype 'values'
+        #-----------------------------------------------------------------------
+        if isinstance(values, compactslottype):
+            return (_compactview(values, "literal"), _compactview(values, "canonical"), _compactview(values, "canonical_lc"))
+        (canonicalindex, canonicalindex_lc) = self._build_canonical_index(slottype, values)
+        return (self._build_literal_index(slottype, values), canonicalindex, canonicalindex_lc)
+
+    def _build_locale_indexes(self, locale):
+        #-----------------------------------------------------------------------      
+        # Private  member function of class applicationslots
+        # builds the indexes for the slot types that have their own literals 
+        # in 'locale'. Called the first time a locale is used
+        # Returns: (dict) slottype -> (literal index, canonical index, lower-cased canonical index)
+        #-----------------------------------------------------------------------
+        indexes = {}
+        localetypes = self._localeslottypes.get(locale, {})
+        if len(localetypes) > 0:
+            myask_log.debug(3, "Building slot type indexes for locale '"+locale+"'")
+        for slottype in localetypes:
+            values = localetypes[slottype]
+            if callable(values): 
+                values = values()
+            if slottype in self._compactslottypes:
+                values = compactslottype(values, self._pronlex)
+            # the loaded list (or compact store) replaces the loader, as for 
+            # the default locale, so that it is saved by SaveCompiled
+            localetypes[slottype] = values
+            indexes[slottype] = self._make_indexes(slottype, values)
+        self._localeindexes[locale] = indexes
+        return indexes
+
+    def _get_indexes(self, slottype, locale):
+        #-----------------------------------------------------------------------      
+        # Private  member function of class applicationslots
+        # Returns: (literal index, canonical index, lower-cased canonical index)
+        #          of a (materialized) slot type for the given locale
+        #          None or an unknown locale selects the default locale
+        #-----------------------------------------------------------------------
+        # unknown locales are not cached, a prepared object is never modified
+        if locale is not None and locale != self._defaultlocale and locale in self._locales:
+            indexes = self._localeindexes.get(locale)
+            if indexes is None:
+                indexes = self._build_locale_indexes(locale)
+            if slottype in indexes:
+                return indexes[slottype]
+        return (self._literalindex[slottype], self._canonicalindex[slottype], self._canonicalindex_lc[slottype])
+
+    def _get_fuzzyindex(self, slottype, locale):
+        #-----------------------------------------------------------------------      
+        # Private  member function of class applicationslots
+        # Returns: the approximate match index of a (materialized) slot type
+        #          for the given locale, built the first time it is used
+        #-----------------------------------------------------------------------
+        (locale, values) = self._get_locale_slottype_values(slottype, locale)
+        index = self._fuzzyindex.get((slottype, locale))
+        if index is None:
+            myask_log.debug(3, "Building approximate match index for slot type '"+slottype+"' ("+locale+")")
+            index = _fuzzyindex(values())
+            self._fuzzyindex[(slottype, locale)] = index
+        return index
+
+    def _get_locale_slottype_values(self, slottype, locale):
+        #-----------------------------------------------------------------------      
+        # Private  member function of class applicationslots
+        # Returns: (locale, function returning the [[canonical, [literals]], ...]
+        #          list of the slot type in this locale). locale is the default
+        #          locale if the slot type has no own literals in 'locale'
+        #-----------------------------------------------------------------------
+        values = self._localeslottypes.get(locale, {}).get(slottype)
+        if locale is None or values is None:
+            return (self._defaultlocale, lambda: self._get_slottype_values(slottype))
+        if callable(values): 
+            # load the slot types of the locale (once), see _build_locale_indexes
+            self._get_indexes(slottype, locale)
+            values = self._localeslottypes[locale][slottype]
+        return (locale, lambda: values)
+
+    def GetDefaultLocale(self):
+        return self._defaultlocale
+
+    def GetLocales(self):
+        #-----------------------------------------------------------------------      
+        #  Public member function of class applicationslots
+        # Returns: (list of strings) all locales with slot literals
+        #-----------------------------------------------------------------------
+        return sorted(self._locales)
+
+    def IsSupportedLocale(self, locale):
+        #-----------------------------------------------------------------------      
+        #  Public member function of class applicationslots
+        # Returns: True if the application has slot literals for 'locale'
+        #-----------------------------------------------------------------------
+        return locale in self._locales
+
+    def _materialize(self, slottype):
+        #-----------------------------------------------------------------------      
+        # Private  member function of class applicationslots
+        # loads and indexes a lazily declared slot type. 
+        # The result is kept for the lifetime of the object (warm container)
+        # The slot type stays pending until loading and indexing succeeded,
+        # so a failed load (e.g. ImportError) is retried on the next lookup
+        #-----------------------------------------------------------------------
+        with _materialize_lock:
+            loader = self._pendingslottypes.get(slottype)
+            if loader is None:
+                return # already materialized (e.g. by another thread)
+            myask_log.debug(3, "Loading slot type '"+slottype+"'")
+            try:
+                self._slottypedefs[slottype] = loader()
+                self._build_indexes(slottype)
+            except Exception as e:
+                myask_log.error("Loading slot type '"+slottype+"' failed: "+str(e))
+                self._slottypedefs[slottype] = loader
+                for index in [self._literalindex, self._canonicalindex, self._canonicalindex_lc]:
+                    index.pop(slottype, None)
+                raise
+            del self._pendingslottypes[slottype]
+
+    def _get_slottype_values(self, slottype):
+        #-----------------------------------------------------------------------      
+        # Private  member function of class applicationslots
+        # Returns: the [[canonical, [literals]], ...] list of a custom slot type
+        #-----------------------------------------------------------------------
+        if slottype in self._pendingslottypes:
+            self._materialize(slottype)
+        return self._slottypedefs[slottype]
+
+    def Prepare(self):
+        #-----------------------------------------------------------------------      
+        #  Public member function of class applicationslots
+        #  loads all lazy slot types and builds the indexes of all locales.
+        #  Afterwards no lookup modifies the object any more, so it can be 
+        #  shared between threads as an immutable snapshot (see appdefholder)
+        #-----------------------------------------------------------------------
+        for slottype in list(self._pendingslottypes):
+            self._materialize(slottype)
+        for locale in self._localeslottypes:
+            if locale not in self._localeindexes:
+                self._build_locale_indexes(locale)
+        if self._fuzzymatching:
+            for slottype in self._slottypedefs:
+                for locale in self._locales:
+                    self._get_fuzzyindex(slottype, locale)
+
+    def GetSlotTypeStats(self):
+        #-----------------------------------------------------------------------      
+        #  Public member function of class applicationslots
+        # Returns: (dict) 'materialized': list of slot types loaded and indexed
+        #                 'pending': list of lazy slot types not yet loaded
+        #-----------------------------------------------------------------------
+        return {
+            'materialized': sorted(self._literalindex.keys()),
+            'pending': sorted(self._pendingslottypes.keys())
+        }
+
+    def _build_literal_index(self, slottype, values):
+        #-----------------------------------------------------------------------      
+        # Private  member function of class applicationslots
+        # Parameters
+        #  - slottype (string): name of a custom slot type
+        #  - values: [[canonical, [literals]], ...] list of the slot type
+        # Returns: (dict) lookup table for the slot type
+        #        - the key is the lower-cased literal
+        #        - the value is the canonical
+        #        - if a literal is listed for several canonicals, the first one wins
+        #-----------------------------------------------------------------------
+        index = {}
+        for entry in values:
+            if len(entry) < 2: 
+                myask_log.error("_build_literal_index: incorrect format for dictionary entry '"+str(entry)+"' in slottype '"+slottype+"'")
+                continue
+            for value in entry[1]:
+                key = value.lower()
+                if key not in index:
+                    index[key] = entry[0]
+        return index
+
+    def _build_canonical_index(self, slottype, values):
+        #-----------------------------------------------------------------------      
+        # Private  member function of class applicationslots
+        # Parameters
+        #  - slottype (string): name of a custom slot type
+        #  - values: [[canonical, [literals]], ...] list of the slot type
+        # Returns: two dicts (exact, lower-cased) canonical -> record
+        #        - record is a tuple (output name, spoken output name, literals)
+        #        - output name is the first literal of the canonical
+        #        - spoken output name is the output name after the pronlex lookup
+        #        - literals is a tuple of all literals of the canonical
+        #        - both dicts share the same record objects
+        #-----------------------------------------------------------------------
+        index = {}
+        index_lc = {}
+        for entry in values:
+            if len(entry) < 2: 
+                continue # already reported by _build_literal_index
+            canonical = entry[0]
+            if canonical in index:
+                continue
+            literals = tuple(entry[1])
+            if len(literals) > 0: outputname = literals[0]
+            else: outputname = canonical
+            record = (outputname, self._pronlex.get(outputname, outputname), literals)
+            index[canonical] = record
+            key = str(canonical).lower()
+            if key not in index_lc:
+                index_lc[key] = record
+        return (index, index_lc)
 
     def _get_slot_value_map(self, slotname):
         #-----------------------------------------------------------------------      
@@ -70,7 +716,87 @@ class applicationdef:
                 myask_log.error("_get_slot_value_map: unknown slottype '" + slottype + "' found for slot '"+ slotname + "'")
                 return [[]]
         
-        return self._slottypedefs[slottype]    
+        return self._get_slottype_values(slottype)
+
+    def SaveCompiled(self, compiledfile, sourcefiles):
+        #-----------------------------------------------------------------------      
+        #  Public member function of class applicationslots
+        # Writes the application definition with all indexes already built
+        # to 'compiledfile', so that it can be loaded with load_compiled
+        # Parameters
+        #  - compiledfile (string): name of the output file
+        #  - sourcefiles (string or list): source files of the appdef, 
+        #        used to detect a stale compiled file (see GetAppDefSourceFiles)
+        #        The modules of externalslottype declarations are added
+        #  The object is prepared before writing (see Prepare), so the compiled
+        #  file contains all slot types and indexes. Compact slot types are 
+        #  only stored in compact format (without the original lists)
+        #  The hash of each source file is stored with its path relative to 
+        #  the compiled file
+        #-----------------------------------------------------------------------
+        if isinstance(sourcefiles, basestring):
+            sourcefiles = [sourcefiles]
+        sourcefiles = list(sourcefiles)
+        for modulename in sorted(self._externalmodules):
+            filename = _get_module_file(modulename)
+            if filename is None:
+                myask_log.warning("SaveCompiled: source file of module '"+modulename+"' not found")
+            elif filename not in sourcefiles:
+                sourcefiles.append(filename)
+        self.Prepare()
+        compileddir = os.path.dirname(os.path.abspath(compiledfile))
+        sources = {}
+        for filename in sourcefiles:
+            sources[os.path.relpath(os.path.abspath(filename), compileddir)] = GetSourceHash(filename)
+        artifact = {
+            'format': COMPILED_FORMAT,
+            'sources': sources,
+            'state': self.__dict__
+        }
+        with open(compiledfile, 'wb') as compiledout:
+            pickle.dump(artifact, compiledout, pickle.HIGHEST_PROTOCOL)
+        myask_log.debug(3, "Compiled application definition written to '"+compiledfile+"'")
+
+    @classmethod
+    def load_compiled(cls, compiledfile, sourcefiles=[]):
+        #-----------------------------------------------------------------------      
+        # Loads an application definition written by SaveCompiled
+        # Parameters
+        #  - compiledfile (string): name of the compiled file
+        #  - sourcefiles (string or list): source files of the appdef, which 
+        #        must have been included when compiling. All source files 
+        #        stored in the compiled file are checked in any case
+        # Returns: applicationdef object, or None if the compiled file cannot 
+        #          be read, has the wrong format or does not match the sources
+        #-----------------------------------------------------------------------
+        try:
+            with open(compiledfile, 'rb') as compiledin:
+                artifact = pickle.load(compiledin)
+        except (IOError, EOFError, pickle.UnpicklingError) as e:
+            myask_log.error("load_compiled: cannot read compiled appdef '"+compiledfile+"': "+str(e))
+            return None
+        if artifact.get('format') != COMPILED_FORMAT:
+            myask_log.error("load_compiled: '"+compiledfile+"' has format "+str(artifact.get('format'))+ 
+                            ", expected "+str(COMPILED_FORMAT)+". Please recompile")
+            return None
+        if isinstance(sourcefiles, basestring):
+            sourcefiles = [sourcefiles]
+        compileddir = os.path.dirname(os.path.abspath(compiledfile))
+        sources = artifact['sources']
+        for filename in sourcefiles:
+            if os.path.relpath(os.path.abspath(filename), compileddir) not in sources:
+                myask_log.error("load_compiled: '"+filename+"' is not a source of '"+compiledfile+"'. Please recompile")
+                return None
+        for filename in sorted(sources):
+            sourcefile = os.path.join(compileddir, filename)
+            if not os.path.exists(sourcefile) or GetSourceHash(sourcefile) != sources[filename]:
+                myask_log.error("load_compiled: '"+compiledfile+"' is stale ('"+filename+"' changed). Please recompile")
+                return None
+
+        appdef = cls("", "", {}, {}, {})
+        appdef.__dict__.update(artifact['state'])
+        myask_log.debug(3, "Compiled application definition loaded from '"+compiledfile+"'")
+        return appdef
 
     def GetAppID(self):
         return self._applicationid
@@ -78,47 +804,92 @@ class applicationdef:
     def GetAppName(self):    
         return self._applicationname
     
-    def CreateIntentDef(self):
+    def WriteIntentDef(self, out):
         #---------------------------------------------------------------------------
-        #
-    
-        intent_json = ""
-        intent_json += "{\n"
-        intent_json += "   \"intents\": ["
-        firstintent = True
+        # writes the ASK intent structure (JSON) to the file object 'out'
+        # The JSON is streamed intent by intent, no complete string is created
+        #---------------------------------------------------------------------------
+        out.write("{\n")
+        out.write("   \"intents\": [")
+        separator = "\n"
         for intent in self._intentdef:
-            if firstintent: 
-                firstintent = False
-                intent_json +="\n"
-            else:
-                intent_json +=",\n"
-            intent_json += "        {\n"
-            intent_json += "         \"intent\": \""+ intent +"\""
-            if intent not in ["AMAZON.HelpIntent", "AMAZON.StopIntent", "AMAZON.CancelIntent", "AMAZON.NoIntent", "AMAZON.YesIntent"]:
-                intent_json += ",\n"
-                intent_json += "         \"slots\": ["
-                firstslot = True
-                for slotname in self._intentdef[intent]:
-                    if firstslot == True: 
-                        firstslot = False
-                        intent_json +="\n"
-                    else:
-                        intent_json +=",\n"
-                    slottype = self.getSlottype(slotname) 
-                    intent_json += "            {\n"
-                    intent_json += "               \"name\": \""+ slotname+ "\",\n"
-                    intent_json += "               \"type\": \""+ slottype+ "\"\n"
-                    intent_json += "            }"
-                intent_json += "\n"
-                intent_json += "          ]\n"
-            else:
-                intent_json += "\n"
-            intent_json += "        }"
-        intent_json += "\n"
-        intent_json += "    ]\n"
-        intent_json += "}\n"
+            out.write(separator)
+            separator = ",\n"
+            self._write_intent(out, intent)
+        out.write("\n")
+        out.write("    ]\n")
+        out.write("}\n")
+
+    def _write_intent(self, out, intent):
+        #---------------------------------------------------------------------------
+        # writes the JSON structure for one intent to the file object 'out'
+        #---------------------------------------------------------------------------
+        out.write("        {\n")
+        out.write("         \"intent\": "+ json.dumps(intent))
+        if intent not in ["AMAZON.HelpIntent", "AMAZON.StopIntent", "AMAZON.CancelIntent", "AMAZON.NoIntent", "AMAZON.YesIntent"]:
+            out.write(",\n")
+            out.write("         \"slots\": [")
+            separator = "\n"
+            for slotname in self._intentdef[intent]:
+                out.write(separator)
+                separator = ",\n"
+                slottype = self.getSlottype(slotname) 
+                out.write("            {\n")
+                out.write("               \"name\": "+ json.dumps(slotname)+ ",\n")
+                out.write("               \"type\": "+ json.dumps(slottype)+ "\n")
+                out.write("            }")
+            out.write("\n")
+            out.write("          ]\n")
+        else:
+            out.write("\n")
+        out.write("        }")
+
+    def CreateIntentDef(self):
+        #---------------------------------------------------------------------------
+        # Returns: (string) the ASK intent structure (JSON)
+        #---------------------------------------------------------------------------
+        intent_json = StringIO()
+        self.WriteIntentDef(intent_json)
+        return intent_json.getvalue()
+
+    def GetIntentHash(self, intent):
+        #---------------------------------------------------------------------------
+        # Returns: hash (hex string) over the name, slots and slot types of an intent
+        #---------------------------------------------------------------------------
+        slots = [[slotname, self.getSlottype(slotname)] for slotname in self._intentdef[intent]]
+        return hashlib.sha1(json.dumps([intent, slots])).hexdigest()
+
+    def GetSlotTypeHash(self, slottype, locale=None):
+        #---------------------------------------------------------------------------
+        # Returns: hash (hex string) over all canonicals and literals of a slot type
+        #          (literals of 'locale', None: default locale)
+        #---------------------------------------------------------------------------
+        typehash = hashlib.sha1(slottype)
+        for entry in self._get_locale_slottype_values(slottype, locale)[1]():
+            typehash.update(json.dumps(list(entry)))
+        return typehash.hexdigest()
+
+    def getAllIntents(self):
+        #-----------------------------------------------------------------------      
+        #  Public member function of class applicationslots
+        # Returns: (list of strings) list of all intents defined in this app
+        #-----------------------------------------------------------------------
+        return list(self._intentdef.keys())
+
+    def getIntentSlots(self, intent):
+        #-----------------------------------------------------------------------      
+        #  Public member function of class applicationslots
+        # Returns: (list of strings) slotnames of 'intent', [] if the intent is unknown
+        #-----------------------------------------------------------------------
+        return self._intentdef.get(intent, [])
+
+    def getAllSlotTypes(self):
+        #-----------------------------------------------------------------------      
+        #  Public member function of class applicationslots
+        # Returns: (list of strings) list of all custom slot types defined in this app
+        #-----------------------------------------------------------------------
+        return list(self._slottypedefs.keys())
 
-        return intent_json
     def getAllSlots(self):
         #-----------------------------------------------------------------------      
         #  Public member function of class applicationslots
@@ -160,12 +931,13 @@ class applicationdef:
             return False
         return str(self._slotdefinitions[slotname]).startswith("AMAZON.")
         
-    def GetSlotOutputName(self, slotname, canonical):
+    def GetSlotOutputName(self, slotname, canonical, locale=None):
         #-----------------------------------------------------------------------      
         #  Public member function of class applicationslots
         # Parameters 
         #  - slotname (string): name of the slot
         #  - canonical (string): normalized internal identifier for a slot value
+        #  - locale: locale of the output (None for the default locale)
         # Returns: (string) generic (spekable) output name for the canonical value
         #              if the value cannot be mapped, return canonical
         #-----------------------------------------------------------------------
@@ -176,28 +948,32 @@ class applicationdef:
         elif len(slotmap) == 1 and slotmap[0][0].startswith("AMAZON"): 
             return canonical      
           
-        for entry in slotmap:
-            if len(entry) < 2: 
-                myask_log.error("gen_GetOuputName: incorrect format for dictionary entry '"+str(entry)+"'")
-                return "ERROR"
-            if entry[0].lower() == str(canonical).lower(): # we got a match
-                return entry[1][0]
+        record = self._get_indexes(self._slotdefinitions[slotname], locale)[2].get(str(canonical).lower())
+        if record is not None: # we got a match
+            return record[0]
      
         # if we are here, we did not find a match
         myask_log.warning("GetOuputName: No match found for'" + str(canonical)+"'")    
         return canonical
         
-    def GetSpokenSlotOutputName(self, slotname, canonical):
+    def GetSpokenSlotOutputName(self, slotname, canonical, locale=None):
         #-----------------------------------------------------------------------      
         #  Public member function of class applicationslots
         # Parameters 
         #  - slotname (string): name of the slot
         #  - canonical (string): normalized internal identifier for a slot value
+        #  - locale: locale of the output (None for the default locale)
         # Returns: (string) generic (spekable) output name for the canonical value
         #              if the value cannot be mapped, return canonical
         #               Check the exception lexicon for specific output formats
         #-----------------------------------------------------------------------
-        text = self.GetSlotOutputName(slotname, canonical)
+        slottype = self._slotdefinitions.get(slotname)
+        if slottype in self._canonicalindex_lc:
+            record = self._get_indexes(slottype, locale)[2].get(str(canonical).lower())
+            if record is not None: 
+                return record[1]
+
+        text = self.GetSlotOutputName(slotname, canonical, locale)
         
         if text in self._pronlex:
             return self._pronlex[text]
@@ -205,13 +981,15 @@ class applicationdef:
             return text
    
 
-    def GetSlotCanonical(self, slotname, literal, strict=False):
+    @myask_log.timed("GetSlotCanonical")
+    def GetSlotCanonical(self, slotname, literal, strict=False, locale=None):
         #-----------------------------------------------------------------------      
         #  Public member function of class applicationslots
         # Parameters 
         #  - slotname (string): name of the slot
         #  - literal (string):slot value as spoken by the user 
         #  - strict If True, '?' is returned if no match was found
+        #  - locale: locale of the input (None for the default locale)
         # Returns: (string) canonical, i.e. normalized internal identifier for a slot value
         #              if the value cannot be mapped, and strict is False, return literal
         #-----------------------------------------------------------------------
@@ -224,21 +1002,96 @@ class applicationdef:
         
         #OK, let's look for the canonical value
         literal = literal.lower()
-        literal.encode("utf-8")
-        for entry in slotmap:
-            if len(entry) < 2: 
-                myask_log.error("gen_GetOuputName: incorrect format for dictionary entry '"+str(entry)+"'")
-                return "?"
-            for value in entry[1]:
-                value = value.lower()
-                value.encode("utf-8")
-                if value == literal:
-                    return entry[0]
+        canonical = self._get_indexes(self._slotdefinitions[slotname], locale)[0].get(literal)
+        if canonical is not None:
+            return canonical
       
         myask_log.warning("GetSlotCanonical: No match found for'" + literal + "'")    
         if strict == True: return "?"
         else: return literal
        
+    def GetSlotCanonicalFuzzy(self, slotname, literal, budget_ms=FUZZY_BUDGET_MS, maxcandidates=FUZZY_MAX_CANDIDATES, locale=None):
+        #-----------------------------------------------------------------------      
+        #  Public member function of class applicationslots
+        #  Like GetSlotCanonical, but if there is no exact match, the best 
+        #  approximate (orthographic/phonetic) match is returned
+        #  Requires applicationdef(..., fuzzymatching=True)
+        # Parameters 
+        #  - slotname (string): name of the slot
+        #  - literal (string):slot value as recognized
+        #  - budget_ms: maximum time for the approximate search
+        #  - maxcandidates: maximum number of candidates compared per index
+        #  - locale: locale of the literal (None: default locale)
+        # The approximate match index of a slot type is built on first use, 
+        # or by Prepare (e.g. when compiling with -compile -fuzzy)
+        # Returns: (canonical, confidence)
+        #        - confidence 1.0 for an exact match or built-in slot types
+        #        - ("?", 0.0) if nothing was found
+        #-----------------------------------------------------------------------
+        slotmap = self._get_slot_value_map(slotname)
+        if len(slotmap) == 0: 
+            myask_log.error("GetSlotCanonicalFuzzy: no slotmap found for slot'"+ slotname + "'")
+            return (literal, 0.0)
+        elif len(slotmap) == 1 and slotmap[0][0].startswith("AMAZON"):
+            return (literal, 1.0)
+
+        slottype = self._slotdefinitions[slotname]
+        canonical = self._get_indexes(slottype, locale)[0].get(literal.lower())
+        if canonical is not None:
+            return (canonical, 1.0)
+        if not self._fuzzymatching:
+            myask_log.error("GetSlotCanonicalFuzzy: approximate matching not enabled (fuzzymatching=False)")
+            return ("?", 0.0)
+        (canonical, confidence) = self._get_fuzzyindex(slottype, locale).Find(literal, budget_ms, maxcandidates)
+        myask_log.debug(5, "GetSlotCanonicalFuzzy: '%s' -> '%s' (%.2f)", literal, canonical, confidence)
+        return (canonical, confidence)
+
+    def GetSlotCanonicals(self, slotname, literals, strict=False, missreport=None, locale=None):
+        #-----------------------------------------------------------------------      
+        #  Public member function of class applicationslots
+        #  Bulk version of GetSlotCanonical for offline processing
+        # Parameters 
+        #  - slotname (string): name of the slot
+        #  - literals (iterable of strings): slot values as spoken by the user 
+        #  - strict If True, '?' is returned if no match was found
+        #  - missreport (dict): if given, receives literal -> count for all 
+        #        literals that could not be mapped
+        #  - locale: locale of the input (None for the default locale)
+        # Returns: generator of canonicals, same results as GetSlotCanonical
+        #        The slot type is resolved only once. Misses are reported in 
+        #        one single warning after the last literal
+        #-----------------------------------------------------------------------
+        slotmap = self._get_slot_value_map(slotname)
+        if len(slotmap) == 0: 
+            myask_log.error("GetSlotCanonicals: no slotmap found for slot'"+ slotname + "'")
+            for literal in literals:
+                yield literal
+            return
+        elif len(slotmap) == 1 and slotmap[0][0].startswith("AMAZON"):
+            for literal in literals:
+                yield literal
+            return
+
+        index = self._get_indexes(self._slotdefinitions[slotname], locale)[0]
+        if missreport is None: missreport = {}
+        total = 0
+        misses = 0
+        for literal in literals:
+            total += 1
+            literal = literal.lower()
+            canonical = index.get(literal)
+            if canonical is not None:
+                yield canonical
+                continue
+            misses += 1
+            missreport[literal] = missreport.get(literal, 0) + 1
+            if strict == True: yield "?"
+            else: yield literal
+
+        if misses > 0:
+            myask_log.warning("GetSlotCanonicals: No match found for "+str(misses)+" of "+str(total)+ 
+                              " literals in slot '"+slotname+"'")
+
     def IsValidSlotCanonical(self, slotname, value):
         slotmap = self._get_slot_value_map(slotname)
         if len(slotmap) == 0: 
@@ -247,23 +1100,17 @@ class applicationdef:
         elif len(slotmap) == 1 and slotmap[0][0].startswith("AMAZON"):
             return True
         #OK, let's look for the canonical value
-        for entry in slotmap:
-            if len(entry) < 2: 
-                myask_log.error("gen_GetOuputName: incorrect format for dictionary entry '"+str(entry)+"'")
-                return "?"  
-            if entry[0] == value:
-                return True;
-        
-        return False;
+        return value in self._canonicalindex[self._slotdefinitions[slotname]]
         
-    def GetValueLiterals(self, slotname, value):
+    def GetValueLiterals(self, slotname, value, locale=None):
         #-----------------------------------------------------------------------      
         #  Public member function of class applicationslots
         # Returns a list of all possible literals for a given slot canonical
         # Parameters 
         #  'slotname' name of the slot under investigation
         #  'value' canonical value
-        # Returns: list of all registered literal for the given canonical as array of strings
+        #  'locale' locale of the literals (None for the default locale)
+        # Returns: all registered literals for the given canonical as list of strings
         # if the slotname is not known or does not have a custom list , returns []
         #-----------------------------------------------------------------------        
         slotmap = self._get_slot_value_map(slotname)
@@ -273,12 +1120,9 @@ class applicationdef:
         elif len(slotmap) == 1 and slotmap[0][0].startswith("AMAZON"):
             return []
         #OK, let's look for the canonical value
-        for entry in slotmap:
-            if len(entry) < 2: 
-                myask_log.error("gen_GetOuputName: incorrect format for dictionary entry '"+str(entry)+"'")
-                return []  
-            if entry[0] == value:
-                return entry[1];
+        record = self._get_indexes(self._slotdefinitions[slotname], locale)[1].get(value)
+        if record is not None:
+            return list(record[2]) # the record is shared, return a copy
         
  
     def GetAllSlotLiterals(self):
@@ -291,15 +1135,97 @@ class applicationdef:
         slotinfo = []
         for slottype in self._slottypedefs:
             # create a list of all literals for this type
-            slot_literals = []
-            values  = self._slottypedefs[slottype]
-            for value in values:
-                literals = value[1]
-                for literal in literals:
-                    slot_literals.append(literal)
-            slotinfo.append((slottype,slot_literals))
+            slotinfo.append((slottype, list(self.IterSlotLiterals(slottype))))
         return (slotinfo)
+
+    def IterSlotLiterals(self, slottype, locale=None):
+        #-----------------------------------------------------------------------      
+        #  Public member function of class applicationslots
+        # Returns: generator of all literals of the custom slot type 'slottype'
+        #          in 'locale' (None: default locale)
+        #-----------------------------------------------------------------------
+        for value in self._get_locale_slottype_values(slottype, locale)[1]():
+            for literal in value[1]:
+                yield literal
     
+    def _get_random_sampler(self, slotname):
+        #-----------------------------------------------------------------------
+        # Private  member function of class applicationslots
+        # Returns: function(rng) that returns a random literal for the slot
+        #          or None if the slot type is not supported
+        #-----------------------------------------------------------------------
+        slottype = self.getSlottype(slotname)
+        if str(slottype).startswith("AMAZON"):
+            if slottype == "AMAZON.NUMBER":
+                return lambda rng: str(rng.randint(0, 100))
+            elif slottype == "AMAZON.DATE":
+                today = datetime.today()
+                return lambda rng: (today + timedelta(rng.randint(0, 30))).strftime('%Y-%m-%d')
+            elif slottype == "AMAZON.DE_REGION":
+                return lambda rng: rng.choice(RANDOM_DE_REGIONS)
+            elif slottype == "AMAZON.DE_FIRST_NAME":
+                return lambda rng: rng.choice(RANDOM_DE_FIRST_NAMES)
+            myask_log.error("_get_random_sampler: Built-in type "+str(slottype)+" not yet handled")
+            return None
+        if slottype not in self._slottypedefs:
+            myask_log.error("_get_random_sampler: no slot definition found for slot "+str(slottype))
+            return None
+        literal_lists = tuple(tuple(entry[1]) for entry in self._get_slottype_values(slottype) if len(entry) > 1 and len(entry[1]) > 0)
+        return lambda rng: rng.choice(rng.choice(literal_lists))
+
+    def GenerateRandomResponses(self, numevents, intentlist=[], seed=None, intentweights={}, fillprobability=0.5, slotfillprobabilities={}):
+        #-----------------------------------------------------------------------
+        # Generator for random intent structures (same format as getRandomResponse)
+        # e.g. for load tests. All sampling tables are built once before the 
+        # first event is returned
+        # Parameters 
+        #  - numevents: number of events to generate
+        #  - intentlist: intents to select from ([] or ["*"] for all intents)
+        #  - seed: seed for the random generator (same seed -> same events,
+        #        AMAZON.DATE values are relative to the current day)
+        #  - intentweights: (dict) intent -> relative weight (default 1)
+        #  - fillprobability: probability that a slot gets a value
+        #  - slotfillprobabilities: (dict) slotname -> fill probability for 
+        #        individual slots (overrides 'fillprobability')
+        #-----------------------------------------------------------------------
+        rng = random.Random(seed)
+        if len(intentlist) == 0 or intentlist[0] == "*":
+            intentlist = sorted(self._intentdef.keys())
+        intents = []
+        cumulativeweights = []
+        totalweight = 0.0
+        samplers = {}
+        for intentname in intentlist:
+            if intentname not in self._intentdef:
+                myask_log.error("GenerateRandomResponses: Invalid intent name '"+intentname+"'")
+                continue
+            weight = intentweights.get(intentname, 1)
+            if weight <= 0: 
+                continue
+            slotplan = []
+            for slotname in self._intentdef[intentname]:
+                if slotname not in samplers:
+                    samplers[slotname] = self._get_random_sampler(slotname)
+                slotplan.append((slotname, slotfillprobabilities.get(slotname, fillprobability), samplers[slotname]))
+            totalweight += weight
+            intents.append((intentname, slotplan))
+            cumulativeweights.append(totalweight)
+        if len(intents) == 0:
+            myask_log.error("GenerateRandomResponses: no valid intent to select from")
+            return
+
+        for i in xrange(numevents):
+            (intentname, slotplan) = intents[bisect_right(cumulativeweights, rng.random() * totalweight)]
+            slotstructure = {}
+            for (slotname, probability, sampler) in slotplan:
+                slotstructure[slotname] = {'name': slotname}
+                if rng.random() < probability:
+                    if sampler is None: 
+                        slotstructure[slotname]['value'] = "UNKNOWN_TYPE"
+                    else:
+                        slotstructure[slotname]['value'] = sampler(rng)
+            yield {'name': intentname, 'slots': slotstructure}
+
     def getRandomResponse(self, intentlist):
         #-----------------------------------------------------------------------
         # returns a random input for one of the intents in the intent list
@@ -364,7 +1290,7 @@ class applicationdef:
                         myask_log.error("_getRandomRespons: no slot definition found for slot "+str(slottype))
                         literal ="UNKNOWN_USER_TYPE"
                     else:
-                        slotvalue_list = self._slottypedefs[slottype]
+                        slotvalue_list = self._get_slottype_values(slottype)
                         slotvalue = random.choice(slotvalue_list)
                         # ok, we got the vlaue (literal,canonicals, let's pick a literal
                         literal_list = slotvalue[1]
@@ -376,6 +1302,267 @@ class applicationdef:
         resulstructure["slots"] = slotstructure
         return resulstructure
     
+###############################################################################
+#
+# versioned application definition snapshots for long-running hosts
+#
+###############################################################################
+
+def LoadAppDefModule(modulename, reloadmodule=False):
+    #--------------------------------------------------------------------------
+    # imports the application definition module 'modulename' and returns
+    # a new applicationdef object for it
+    # if 'reloadmodule' is True, the module is re-read from disk, together
+    # with the slot list modules it imports from its own directory and the
+    # (already imported) modules of its externalslottype declarations
+    #--------------------------------------------------------------------------
+    appdef_module = __import__(modulename)
+    if reloadmodule:
+        for importname in _get_local_imports(appdef_module):
+            if importname in sys.modules and importname != modulename:
+                reload(sys.modules[importname])
+        appdef_module = reload(appdef_module)
+        for importname in _get_external_modules(appdef_module):
+            if importname in sys.modules:
+                reload(sys.modules[importname])
+    return applicationdef(appdef_module.APPNAME, 
+                          appdef_module.APPID,
+                          appdef_module.INTENTS, 
+                          appdef_module.SLOTS, 
+                          appdef_module.SLOTTYPES,
+                          getattr(appdef_module, "PRONLEX", {}),
+                          localeslottypes=getattr(appdef_module, "LOCALESLOTTYPES", {}))
+
+class appdefholder:
+    #--------------------------------------------------------------------------
+    # holds the active application definition of a long-running host 
+    # (e.g. a local HTTP server instead of AWS lambda)
+    # 
+    # Each request takes the current snapshot once (GetAppDef/GetSnapshot)
+    # and uses it until the end of the request. Reload builds and indexes a
+    # new applicationdef (in a background thread) and then replaces the 
+    # active snapshot in one step. Requests that are still running keep 
+    # their old snapshot, there are no mixed-version lookups.
+    # Published snapshots are prepared (see applicationdef.Prepare) and are
+    # never modified afterwards.
+    #--------------------------------------------------------------------------
+    def __init__(self, appdef):
+        appdef.Prepare()
+        self._snapshot = (1, appdef)
+        self._lock = threading.Lock()
+        # sequence numbers of builds: the next build started, the active build
+        self._nextbuild = 1
+        self._activebuild = 0
+
+    def GetSnapshot(self):
+        #-----------------------------------------------------------------------
+        # Returns: (version, applicationdef) of the active snapshot
+        #-----------------------------------------------------------------------
+        return self._snapshot
+
+    def GetAppDef(self):
+        #-----------------------------------------------------------------------
+        # Returns: applicationdef of the active snapshot
+        #-----------------------------------------------------------------------
+        return self._snapshot[1]
+
+    def GetVersion(self):
+        return self._snapshot[0]
+
+    def _next_build(self):
+        with self._lock:
+            build = self._nextbuild
+            self._nextbuild += 1
+        return build
+
+    def _build_and_swap(self, builder, build):
+        #-----------------------------------------------------------------------
+        # builds a new applicationdef with 'builder' and activates it
+        # 'build': sequence number of the build, assigned when it is started. 
+        # A build that finishes after a build started later is dropped
+        # Returns: new version, 0 if the build failed or was dropped 
+        #          (old snapshot stays active)
+        #-----------------------------------------------------------------------
+        try:
+            appdef = builder()
+            appdef.Prepare()
+        except Exception as e:
+            myask_log.error("appdefholder: building new application definition failed: "+str(e))
+            return 0
+        with self._lock:
+            if build < self._activebuild:
+                myask_log.debug(3, "appdefholder: build "+str(build)+" dropped, a newer build is already active")
+                return 0
+            self._activebuild = build
+            version = self._snapshot[0] + 1
+            self._snapshot = (version, appdef)
+        myask_log.debug(3, "appdefholder: application definition version "+str(version)+" activated")
+        return version
+
+    def Reload(self, builder, background=True):
+        #-----------------------------------------------------------------------
+        # replaces the active snapshot by a new applicationdef
+        # 'builder': function without parameters returning the new applicationdef
+        #             e.g. lambda: LoadAppDefModule("myappdef", reloadmodule=True)
+        # 'background': if True, the new snapshot is built in a separate thread
+        # Returns: the started thread if background is True, else the new version
+        #          (0 if the build failed)
+        #-----------------------------------------------------------------------
+        build = self._next_build()
+        if not background:
+            return self._build_and_swap(builder, build)
+        thread = threading.Thread(target=self._build_and_swap, args=(builder, build))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+###############################################################################
+#
+# memory comparison between list-of-lists and compact slot type storage
+#
+###############################################################################
+
+def _deepsizeof(obj, seen):
+    #--------------------------------------------------------------------------
+    # approximate memory (bytes) used by obj and all objects it references
+    # objects in 'seen' (set of ids) are only counted once
+    #--------------------------------------------------------------------------
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key in obj:
+            size += _deepsizeof(key, seen) + _deepsizeof(obj[key], seen)
+    elif isinstance(obj, (list, tuple, set)):
+        for item in obj:
+            size += _deepsizeof(item, seen)
+    elif hasattr(obj, "__dict__"):
+        size += _deepsizeof(obj.__dict__, seen)
+    return size
+
+def _load_compiled_copy(appdef, compiledfile):
+    #--------------------------------------------------------------------------
+    # writes 'appdef' to 'compiledfile' and loads it again (handler load path)
+    # Returns: (loaded applicationdef, size of the compiled file in bytes)
+    #--------------------------------------------------------------------------
+    appdef.SaveCompiled(compiledfile, [])
+    filesize = os.path.getsize(compiledfile)
+    loaded = applicationdef.load_compiled(compiledfile)
+    os.remove(compiledfile)
+    return (loaded, filesize)
+
+def CompareSlotTypeMemory(numliterals=200000):
+    #--------------------------------------------------------------------------
+    # builds a synthetic slot type with 'numliterals' literals (2 per canonical)
+    # compiles it in list-of-lists format and in compact format and prints 
+    # the memory used by the loaded application definitions
+    # (same path as a handler using load_compiled, the original lists are 
+    # not referenced anymore)
+    #--------------------------------------------------------------------------
+    values = []
+    for i in xrange(numliterals // 2):
+        values.append(["STATION_%06d" % i, [u"Haltestelle %d Nord" % i, u"Station %d" % i]])
+    slots = {"Station": "LIST_OF_STATIONS"}
+    compileddir = tempfile.mkdtemp()
+    compiledfile = os.path.join(compileddir, "memcompare.pkl")
+
+    (listappdef, listfilesize) = _load_compiled_copy(applicationdef("", "", {}, slots, {"LIST_OF_STATIONS": values}), compiledfile)
+    (compactappdef, compactfilesize) = _load_compiled_copy(
+        applicationdef("", "", {}, slots, {"LIST_OF_STATIONS": values}, compactslottypes=["LIST_OF_STATIONS"]), compiledfile)
+    os.rmdir(compileddir)
+    del values
+    listsize = _deepsizeof(listappdef.__dict__, set())
+    compactsize = _deepsizeof(compactappdef.__dict__, set())
+
+    for literal in [u"station 4711", u"haltestelle 12 nord", u"unknown"]:
+        if listappdef.GetSlotCanonical("Station", literal) != compactappdef.GetSlotCanonical("Station", literal):
+            myask_log.error("CompareSlotTypeMemory: different results for '"+literal+"'")
+
+    print("Compiled slot type with "+str(numliterals)+" literals, loaded with load_compiled:")
+    print("  list of lists + indexes: {:10.1f} MB (file {:.1f} MB)".format(listsize / 1048576.0, listfilesize / 1048576.0))
+    print("  compactslottype:         {:10.1f} MB (file {:.1f} MB)".format(compactsize / 1048576.0, compactfilesize / 1048576.0))
+    print("  ratio:                   {:10.1f}".format(float(listsize) / compactsize))
+
+###############################################################################
+#
+# incremental build of the ASK interaction model
+#
+###############################################################################
+
+def _write_slottype(out, appdef, slottype, locale=None):
+    #--------------------------------------------------------------------------
+    # writes the literal list of one custom slot type to file object 'out'
+    #--------------------------------------------------------------------------
+    out.write("\n--- "+slottype+" ---\n")
+    for literal in appdef.IterSlotLiterals(slottype, locale):
+        out.write(literal.encode('utf8')+"\n")
+
+def IncrementalBuild(appdef, output_root, locale=None):
+    #--------------------------------------------------------------------------
+    # writes the ASK files for 'appdef' (slot literals of 'locale', None: 
+    # default locale), but only rewrites files whose content has changed 
+    # since the last build:
+    #  ROOT+"_intentstruct_generated.js"  : if any intent has changed
+    #  ROOT+"_customtypes/<SLOTTYPE>.txt" : one fragment per custom slot type
+    #  ROOT+"_customtypes_generated.txt"  : concatenation of all fragments
+    # The hashes of the last build are stored in ROOT+"_build_manifest.json"
+    # Returns: (number of rewritten intent files, number of rewritten fragments)
+    #--------------------------------------------------------------------------
+    manifestfile = output_root+"_build_manifest.json"
+    intentfile = output_root+"_intentstruct_generated.js"
+    typefile = output_root+"_customtypes_generated.txt"
+    typedir = output_root+"_customtypes"
+    try:
+        with open(manifestfile, 'r') as manifestin:
+            manifest = json.load(manifestin)
+    except (IOError, ValueError):
+        myask_log.debug(3, "No valid build manifest found, rebuilding everything")
+        manifest = {}
+    oldintents = manifest.get("intents", {})
+    oldtypes = manifest.get("slottypes", {})
+
+    intenthashes = {}
+    for intent in appdef.getAllIntents():
+        intenthashes[intent] = appdef.GetIntentHash(intent)
+    intentsrewritten = 0
+    if intenthashes != oldintents or not os.path.exists(intentfile):
+        myask_log.debug(3, "Writing intent structure to file '"+intentfile+"'")
+        with open(intentfile, 'w+') as intentout:
+            appdef.WriteIntentDef(intentout)
+        intentsrewritten = 1
+    
+    if not os.path.isdir(typedir):
+        os.makedirs(typedir)
+    typehashes = {}
+    fragmentsrewritten = 0
+    for slottype in sorted(appdef.getAllSlotTypes()):
+        typehashes[slottype] = appdef.GetSlotTypeHash(slottype, locale)
+        fragment = os.path.join(typedir, slottype+".txt")
+        if typehashes[slottype] == oldtypes.get(slottype) and os.path.exists(fragment):
+            continue
+        myask_log.debug(3, "Writing custom data type '"+slottype+"' to file '"+fragment+"'")
+        with open(fragment, 'w+') as typeout:
+            _write_slottype(typeout, appdef, slottype, locale)
+        fragmentsrewritten += 1
+    for slottype in oldtypes:
+        if slottype not in typehashes:
+            fragment = os.path.join(typedir, slottype+".txt")
+            if os.path.exists(fragment):
+                os.remove(fragment)
+
+    if typehashes != oldtypes or not os.path.exists(typefile):
+        myask_log.debug(3, "Writing custom data type definitions to file '"+typefile+"'")
+        with open(typefile, 'w+') as typeout:
+            for slottype in sorted(typehashes):
+                with open(os.path.join(typedir, slottype+".txt"), 'r') as fragmentin:
+                    shutil.copyfileobj(fragmentin, typeout)
+
+    with open(manifestfile, 'w+') as manifestout:
+        json.dump({"intents": intenthashes, "slottypes": typehashes}, manifestout, indent=1, sort_keys=True)
+    myask_log.debug(3, "Incremental build: "+str(intentsrewritten)+" intent file(s), "+str(fragmentsrewritten)+" slot type fragment(s) rewritten")
+    return (intentsrewritten, fragmentsrewritten)
+
 ###############################################################################
 #
 # stand alone usage as command line tool
@@ -383,6 +1570,10 @@ class applicationdef:
 # parses application definition file and creates files fo ASK:
 # intent structure --> ROOT+"_intentstruct_generated.js"
 # custom slottypes  --> ROOT+"_customtypes_generated.txt"
+# for each additional locale in LOCALESLOTTYPES the same files with 
+# ROOT+"_"+LOCALE (e.g. ROOT_en-US_customtypes_generated.txt)
+# precompiled appdef --> COMPILEDFILE (option -compile), see load_compiled
+# option -incremental: only changed files are rewritten, see IncrementalBuild
 ###############################################################################
    
 def main():
@@ -392,15 +1583,32 @@ def main():
 
     parser.add_argument("-out", "--outputfile_root", type=str, 
                         help="basename for output files")
-    parser.add_argument("inputfile", help="grammar file as input")
+    parser.add_argument("-incremental", "--incremental_build", action="store_true",
+                        help="only rewrite output files that have changed (requires -out)")
+    parser.add_argument("-compile", "--compiled_file", type=str, 
+                        help="write precompiled application definition to this file")
+    parser.add_argument("-fuzzy", "--fuzzy_matching", action="store_true",
+                        help="enable approximate matching (the indexes are included in the compiled file)")
+    parser.add_argument("-source", "--extra_source", type=str, action="append", default=[],
+                        help="additional source file of the compiled file (can be repeated)")
+    parser.add_argument("-compact", "--compact_slottype", type=str, action="append", default=[],
+                        help="store this slot type in compact format (can be repeated, ALL: all custom slot types)")
+    parser.add_argument("-memcompare", "--memory_comparison", type=int, 
+                        help="compare memory usage of list and compact slot types for the given number of literals")
+    parser.add_argument("inputfile", nargs='?', help="grammar file as input")
 
     args = parser.parse_args()    
     
     if args.verbosity:
         myask_log.SetDebugLevel(args.verbosity)
 
+    if args.memory_comparison:
+        CompareSlotTypeMemory(args.memory_comparison)
+        return
+
     if  args.inputfile: inputfile = args.inputfile
-    else: inputfile = "input.py" # dummy, we will never get here
+    else: 
+        parser.error("missing inputfile")
     
     if inputfile.endswith('.py'):
         inputfile = inputfile[:-3]
@@ -421,48 +1629,72 @@ def main():
         myask_log.debug(3, "Application definition importet from '"+inputfile+".py'")
    
         myask_log.debug(5, "Initializing application definition")
+        if "ALL" in args.compact_slottype: compactslottypes = appdef_module.SLOTTYPES.keys()
+        else: compactslottypes = args.compact_slottype
 
         appdef = applicationdef(appdef_module.APPNAME, 
                                 appdef_module.APPID,
                                 appdef_module.INTENTS, 
                                 appdef_module.SLOTS, 
-                                appdef_module.SLOTTYPES)
+                                appdef_module.SLOTTYPES,
+                                getattr(appdef_module, "PRONLEX", {}),
+                                compactslottypes=compactslottypes,
+                                fuzzymatching=args.fuzzy_matching,
+                                localeslottypes=getattr(appdef_module, "LOCALESLOTTYPES", {}))
+        # output file root per locale, the default locale uses ROOT
+        locales = [appdef.GetDefaultLocale()] + [l for l in appdef.GetLocales() if l != appdef.GetDefaultLocale()]
+        localeroots = {}
+        for locale in locales:
+            if locale == appdef.GetDefaultLocale(): localeroots[locale] = output_root
+            else: localeroots[locale] = output_root+"_"+locale
     
+        if args.compiled_file:
+            appdef.SaveCompiled(args.compiled_file, GetAppDefSourceFiles(appdef_module) + args.extra_source)
+
+        if args.incremental_build:
+            if output_root == "":
+                myask_log.error("-incremental requires -out")
+                return
+            for locale in locales:
+                IncrementalBuild(appdef, localeroots[locale], locale)
+            myask_log.debug(3, "Done")
+            return
+
         myask_log.debug(5, "Creating ASK intent structure")
-        intent_json = appdef.CreateIntentDef()
- 
    
         if output_root == "":
             # print to standard outpt
             print("=======BEGIN INTENT DEF=====================================\n\n")
-            print intent_json
+            print appdef.CreateIntentDef()
             print("\n=======END INTENT DEF=====================================\n\n")
         else: 
-            intentfile = output_root+"_intentstruct_generated.js"
-            myask_log.debug(3, "Writing intent structure to file '"+intentfile+"'")
-            intentout = open(intentfile, 'w+')
-            intentout.write(intent_json)
-            intentout.close()
+            for locale in locales:
+                intentfile = localeroots[locale]+"_intentstruct_generated.js"
+                myask_log.debug(3, "Writing intent structure to file '"+intentfile+"'")
+                with open(intentfile, 'w+') as intentout:
+                    appdef.WriteIntentDef(intentout)
 
-        typeinfo = appdef.GetAllSlotLiterals()
         if output_root == "":
             # print to standard outpt
-            print("=======BEGIN CUSTOM_TYPE DEFINITIONS========================\n\n")
-            for (slottype, slotliterals) in typeinfo:
-                print("\n--- "+slottype+" ---")
-                for literal in slotliterals:
-                    print literal
-            print("\n=======END CUSTOM_TYPE DEFINITIONS========================\n\n")
+            for locale in locales:
+                if locale == appdef.GetDefaultLocale(): header = ""
+                else: header = " ("+locale+")"
+                print("=======BEGIN CUSTOM_TYPE DEFINITIONS"+header+"========================\n\n")
+                for slottype in appdef.getAllSlotTypes():
+                    print("\n--- "+slottype+" ---")
+                    for literal in appdef.IterSlotLiterals(slottype, locale):
+                        print literal
+                print("\n=======END CUSTOM_TYPE DEFINITIONS"+header+"========================\n\n")
         else: 
-            typefile = output_root+"_customtypes_generated.txt"
-            myask_log.debug(3, "Writing custom data type definitions to file '"+typefile+"'")
-            typeout = open(typefile, 'w+')
-            for (slottype, slotliterals) in typeinfo:
-                typeout.write("\n--- "+slottype+" ---\n")
-                for literal in slotliterals:
-                    typeout.write(literal.encode('utf8')+"\n")
-                    
-            typeout.close()
+            for locale in locales:
+                typefile = localeroots[locale]+"_customtypes_generated.txt"
+                myask_log.debug(3, "Writing custom data type definitions to file '"+typefile+"'")
+                with open(typefile, 'w+') as typeout:
+                    for slottype in appdef.getAllSlotTypes():
+                        _write_slottype(typeout, appdef, slottype, locale)
             myask_log.debug(3, "Done")
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # run from the imported module, so that compiled files reference 
+    # myask_appdef classes (and not __main__) and can be loaded by handlers
+    import myask_appdef
+    myask_appdef.main()
\ No newline at end of file
@@ -17,6 +17,8 @@
 ################################################################################
 from __future__ import print_function # Python 2/3 compatibility
 import boto3
+import botocore.config
+import threading
 import json
 import decimal
 import datetime 
@@ -33,36 +35,102 @@ os.environ["TZ"] = "CET"
 DBTYPE = "online"
 DBRESOURCE = "eu-west-1"
 
+# connection settings of the dynamodb resources
+DB_MAX_POOL_CONNECTIONS = 10
+DB_TCP_KEEPALIVE = True
+
+# resources and tables are created once per thread and reused, so that warm 
+# lambda containers keep their connections. boto3 sessions, resources and 
+# Table objects are not thread-safe, so each thread gets its own.
+# per thread: (DBTYPE, DBRESOURCE) -> resource, (DBTYPE, DBRESOURCE, tablename) -> Table
+_thread_cache = threading.local()
+# incremented by ClearDbCache, a thread discards its cache if it is older
+_cache_generation = 0
+_cache_lock = threading.Lock()
+
 def SetDbType(dbtype, resource=""):
     global DBTYPE
     global DBRESOURCE
     
     myask_log.debug(3, "myadk_dynamodb.SetDbType: dbtype='"+dbtype+"' resource='"+resource+"'")
-    DBRESOURCE = resource
-    if dbtype == "online": # use dynamo online db
-        DBTYPE = "online"
-        return True
-    elif dbtype == "offline": # use dynamo  db installed locally
-        DBTYPE = "offline"
-        return True
-    else:
+    if dbtype not in ["online", "offline"]:
         myask_log.error("myadk_dynamodb.SetDbType: invalid dbtype '"+dbtype+"'")
         return False
-    
+    if (dbtype, resource) != (DBTYPE, DBRESOURCE):
+        ClearDbCache()
+    DBRESOURCE = resource
+    DBTYPE = dbtype  # "online": dynamo online db, "offline": dynamo db installed locally
+    return True
+
+def ConfigureDbConnections(max_pool_connections=None, tcp_keepalive=None):
+    #--------------------------------------------------------------------------
+    # changes the connection pool size and keep-alive setting
+    # for all resources created from now on (cached resources are discarded)
+    #--------------------------------------------------------------------------
+    global DB_MAX_POOL_CONNECTIONS
+    global DB_TCP_KEEPALIVE
+    if max_pool_connections is not None: DB_MAX_POOL_CONNECTIONS = max_pool_connections
+    if tcp_keepalive is not None: DB_TCP_KEEPALIVE = tcp_keepalive
+    ClearDbCache()
+
+def ClearDbCache():
+    #--------------------------------------------------------------------------
+    # discards the cached dynamodb resources and tables of all threads
+    #--------------------------------------------------------------------------
+    global _cache_generation
+    with _cache_lock:
+        _cache_generation += 1
+
+def _getThreadCache():
+    #--------------------------------------------------------------------------
+    # returns the (resource cache, table cache) of the current thread
+    #--------------------------------------------------------------------------
+    generation = _cache_generation
+    if getattr(_thread_cache, "generation", None) != generation:
+        _thread_cache.generation = generation
+        _thread_cache.resources = {}
+        _thread_cache.tables = {}
+    return (_thread_cache.resources, _thread_cache.tables)
+
+def _getConfig():
+    try:
+        return botocore.config.Config(max_pool_connections=DB_MAX_POOL_CONNECTIONS, 
+                                      tcp_keepalive=DB_TCP_KEEPALIVE)
+    except TypeError:
+        # botocore versions before 1.27 do not support tcp_keepalive
+        myask_log.debug(3, "myadk_dynamodb: tcp_keepalive not supported by botocore")
+        return botocore.config.Config(max_pool_connections=DB_MAX_POOL_CONNECTIONS)
+
 def _getDynamoDB():
     #--------------------------------------------------------------------------
     # helper function to return a resource pointing to dynamodb server
+    # the resource is created once per thread, DBTYPE and DBRESOURCE,
+    # each with its own boto3 session
     #--------------------------------------------------------------------------
-    global DBTYPE
-    global DBRESOURCE
-    if DBTYPE == "online": # use dynamo online db
-        dynamodb = boto3.resource('dynamodb', region_name=DBRESOURCE)
-    elif DBTYPE == "offline": # use dynamo  db installed locally
-        dynamodb = boto3.resource('dynamodb', endpoint_url=DBRESOURCE)
-    
-
+    key = (DBTYPE, DBRESOURCE)
+    (resources, tables) = _getThreadCache()
+    dynamodb = resources.get(key)
+    if dynamodb is None:
+        session = boto3.session.Session()
+        if DBTYPE == "online": # use dynamo online db
+            dynamodb = session.resource('dynamodb', region_name=DBRESOURCE, config=_getConfig())
+        elif DBTYPE == "offline": # use dynamo  db installed locally
+            dynamodb = session.resource('dynamodb', endpoint_url=DBRESOURCE, config=_getConfig())
+        resources[key] = dynamodb
     return dynamodb
 
+def _getTable(tablename):
+    #--------------------------------------------------------------------------
+    # returns the (cached) Table object for 'tablename' of the current thread
+    #--------------------------------------------------------------------------
+    key = (DBTYPE, DBRESOURCE, tablename)
+    (resources, tables) = _getThreadCache()
+    table = tables.get(key)
+    if table is None:
+        table = _getDynamoDB().Table(tablename)
+        tables[key] = table
+    return table
+
 def get_date_str():
     #--------------------------------------------------------------------------
     # returns a string for the current date in the form YYYY-MM-DD_hh:mm
@@ -98,11 +166,13 @@ class dynamoDB:
         # initialize a new dynamo db object by loading the table 'tablename'
         # The success information is stored in _success
         # The calling function must check this with GetStatus() call (should be "OK")
+        # The object uses the Table of the current thread, so it must not be 
+        # shared between threads (create one per request)
         #-----------------------------------------------------------------------
        
         self._table = ""
         self._dynamodb = _getDynamoDB()
-        self._table = self._dynamodb.Table(tablename)
+        self._table = _getTable(tablename)
 
         
         self._sucess = "OK"
@@ -116,6 +186,7 @@ class dynamoDB:
         return self._sucess
     
     
+    @myask_log.timed("dynamoDB.CreateNewUserProfile")
     def CreateNewUserProfile(self, userid, profile):
         #-----------------------------------------------------------------------
         # Creates a new user profile for the specified id
@@ -136,6 +207,7 @@ class dynamoDB:
                  })
         return response
     
+    @myask_log.timed("dynamoDB._touchProfile")
     def _touchProfile(self, userid):
         response = self._table.update_item(
                     Key={'UserID': userid},
@@ -145,11 +217,12 @@ class dynamoDB:
                             ':t' : get_date_str()
                     },
                     ReturnValues="UPDATED_NEW")
-        myask_log.debug(5, "Updating UserProfileTimeStamps: " + str(response))
+        myask_log.debug(5, "Updating UserProfileTimeStamps: %s", response)
 
         return True
  
         
+    @myask_log.timed("dynamoDB.GetStatistics")
     def GetStatistics(self, userid):
         created = ""
         num_queries = -1
@@ -167,11 +240,12 @@ class dynamoDB:
                 if 'NumQueries' in response['Item']: num_queries = response['Item']['NumQueries']
                 if 'LastQuery' in response['Item']: last_query = response['Item']['LastQuery']
             else:
-                myask_log.debug(5,"GetStatistics: User profile NOT found:"+ str(userid))
+                myask_log.debug(5, "GetStatistics: User profile NOT found:%s", userid)
 
         return [created,num_queries,last_query]
         
         
+    @myask_log.timed("dynamoDB.FetchUserProfile")
     def FetchUserProfile(self, userid):
         #-----------------------------------------------------------------------
         # returns the "profile" part of a given user profile
@@ -190,19 +264,21 @@ class dynamoDB:
                 if 'Item' in response and 'Profile' in response['Item']:
                     profile = response['Item']['Profile']
                     if 'debuguser' in response['Item']:
-                        myask_log.debug(5, "DEBUGUSER: '"+ str(response['Item']['debuguser']) +"'")
+                        myask_log.debug(5, "DEBUGUSER: '%s'", response['Item']['debuguser'])
                         profile['debuguser'] = response['Item']['debuguser']
-                    myask_log.debug(5,"fetchUserProfile: User profile found:"+ str(userid))
+                        if profile['debuguser']: myask_log.EnableRequestDebug()
+                    myask_log.debug(5, "fetchUserProfile: User profile found:%s", userid)
                     # update access log for this user profile
                     self._touchProfile(userid)
                     return profile
                 else :
-                    myask_log.debug(5,"fetchUserProfile: Invalid response format: "+ str(response))
+                    myask_log.debug(5, "fetchUserProfile: Invalid response format: %s", response)
                     return {}
             else:
-                myask_log.debug(5,"fetchUserProfile: User profile NOT found:"+ str(userid))
+                myask_log.debug(5, "fetchUserProfile: User profile NOT found:%s", userid)
                 return {}
 
+    @myask_log.timed("dynamoDB.UpdateUserProfile")
     def UpdateUserProfile(self, userid, profile):
         #-----------------------------------------------------------------------
         # Updates an existing user profile with the information in "profile"
@@ -218,10 +294,11 @@ class dynamoDB:
             myask_log.error("UpdateUserProfile: Error: "+e.response['Error']['Message'])
             return False
         else:
-            myask_log.debug(2, "UpdateUserProfile: " + str(response))
+            myask_log.debug(2, "UpdateUserProfile: %s", response)
 
         return True
 
+    @myask_log.timed("dynamoDB.DeleteUserProfile")
     def DeleteUserProfile(self, userid):
         #----------------------------------------------------------------------
         # delete a specific user profile from the table
@@ -264,6 +341,7 @@ class dynamoDB:
         print(res_str)
         
         
+    @myask_log.timed("dynamoDB.ScanAllProfiles")
     def ScanAllProfiles(self, profilefields=["ALL"]):
         response = self._table.scan()
 
@@ -275,6 +353,7 @@ class dynamoDB:
                 for i in response['Items']:
                     self.printProfileSummary(i, profilefields)
 
+    @myask_log.timed("dynamoDB.GetExistingOneTimeCode")
     def GetExistingOneTimeCode(self,userid):
         if self._table == "": 
             myask_log.error("GetStatistics: attempted without valid table")
@@ -290,6 +369,7 @@ class dynamoDB:
                     
         return ""
                       
+    @myask_log.timed("dynamoDB.GenerateOneTimeCode")
     def GenerateOneTimeCode(self,userid):
         #-----------------------------------------------------------------------
         # Creates a one-time passcode (6-digit number) that allows to 
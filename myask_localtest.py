@@ -67,6 +67,7 @@ def printTestStatistics():
     print ("Wrong end state:   " + str(g_incorrect_final_states))
     
     print ("================================")
+    myask_log.DumpTimings()
     
 def batchtest(batchfile, testdir, intentfilter, handlerfunction):    
     #--------------------------------------------------------------------------
@@ -100,7 +101,6 @@ def batchtest(batchfile, testdir, intentfilter, handlerfunction):
             if test_intent == "":
                 continue
             elif (len(intentfilter) == 0 or intentfilter[0] == '*'  or test_intent in intentfilter):
-                myask_log.ResetErrorCounters()
                 filename = testdir + jsonfile
                 print ("---Testing intent '"+ test_intent +"'")
                 print (">>>>> "+ user_input +"("+filename+")")
@@ -109,7 +109,7 @@ def batchtest(batchfile, testdir, intentfilter, handlerfunction):
     printTestStatistics()
     
     
-def randomtest(num_tests, intentfilter, testusers, appdef, handlerfunction):
+def randomtest(num_tests, intentfilter, testusers, appdef, handlerfunction, seed=None):
     #--------------------------------------------------------------------------
     # creates random Alexa NLU output and runs them through the system
     # PARAMETERS:
@@ -118,16 +118,18 @@ def randomtest(num_tests, intentfilter, testusers, appdef, handlerfunction):
     # 'appdef'   : application definition class object 
     #              (intent/slot definitions from which test cases are created)
     # 'handlerrfunction' (pointer to) lambda handler function
+    # 'seed' seed for the random generator, use the same seed to repeat a test
     #--------------------------------------------------------------------------    
     inittest()
+    rng = random.Random(seed)
     
-    for i in range(num_tests):
-        myask_log.ResetErrorCounters()        
-        sessionresult = appdef.getRandomResponse(intentfilter)
-        userid = random.choice(testusers)
+    i = 0
+    for sessionresult in appdef.GenerateRandomResponses(num_tests, intentfilter, seed):
+        userid = rng.choice(testusers)
         event = CreateSessionData(sessionresult, appdef.GetAppID(), userid)
         print("Random session" + str(i) +":"+str(event))
         TestEvent(event, handlerfunction)
+        i += 1
 
     printTestStatistics()
     
@@ -154,6 +156,8 @@ def TestEvent(event, handlerfunction, expected_result_state=""):
     # - g_total_with_errors
     # - g_total_with_warnings
     # - g_total_ok
+    # errors, warnings and the dialog state are taken from a request context
+    # of their own, so events can be tested from several threads
     #--------------------------------------------------------------------------
     
     global g_total_count
@@ -168,9 +172,11 @@ def TestEvent(event, handlerfunction, expected_result_state=""):
     context = {}
     g_total_count += 1
 
-    returnjson = handlerfunction(event, context, True)
+    userid = event.get('session', {}).get('user', {}).get('userId')
+    with myask_log.requestcontext(userid=userid) as requestctx:
+        returnjson = handlerfunction(event, context, True)
     
-    myask_log.debug(1, "RESULT: " +str(returnjson))
+    myask_log.debug(1, "RESULT: %s", returnjson)
     speech_output="ERROR"
     if 'response' in returnjson and 'outputSpeech' in returnjson['response']: 
         if 'type' in  returnjson['response']['outputSpeech']:                                            
@@ -182,7 +188,7 @@ def TestEvent(event, handlerfunction, expected_result_state=""):
         print("<<<<< " + speech_output)
         print("------\n" + returnjson['response']['card']['content'] +"\n-----")
         g_passed_count += 1
-        final_state = myask_log.GetDialogState()
+        final_state = requestctx.final_state
         if(expected_result_state != ""):
             if final_state == expected_result_state:   
                 print("Final State: "+final_state+ "--> OK")
@@ -192,7 +198,7 @@ def TestEvent(event, handlerfunction, expected_result_state=""):
                 g_incorrect_final_states += 1
         else:
             print("Final State: "+final_state+ "  (no expected state given)")
-        [errors, warnings] = myask_log.GetErrorCounters()
+        [errors, warnings] = [requestctx.errorcount, requestctx.warningcount]
         if errors > 0: g_total_with_errors +=1
         elif warnings > 0: g_total_with_warnings +=1      
         else: g_total_ok +=1              
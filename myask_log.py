@@ -11,23 +11,125 @@
 #-------------------------------------------------------------------------------
 ################################################################################
 
+import threading
+import time
+import sys
+import json
+import random
+import math
+import functools
+import atexit
+
 DEBUG_LEVEL = 99
-errorcount = 0
-warningcount = 0
-final_state = ""
 
 show_debugslots = False
 
+class requestcontext:
+    #--------------------------------------------------------------------------
+    # error/warning counters and dialog state of one request
+    # Used as context manager, it is the active context of the current thread
+    # until the block is left:
+    #     with myask_log.requestcontext() as context:
+    #         result = handler(event, ...)
+    #     print context.errorcount
+    # The counters are then added to the totals (see GetTotalCounters). 
+    # Outside of a with block, the default context of the process is used.
+    # 'request_id' is added to structured log records (see jsonlinesink)
+    # 'userid' is used for debug sampling (see SetDebugSampling)
+    # Leaving the with block flushes the log sink.
+    #--------------------------------------------------------------------------
+    def __init__(self, request_id="", userid=None):
+        self.request_id = request_id
+        self.debuglevel = _sample_debuglevel(userid)
+        self.errorcount = 0
+        self.warningcount = 0
+        self.final_state = ""
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = getattr(_local, "context", None)
+        _local.context = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.context = self._previous
+        self._previous = None
+        with _totals_lock:
+            _totals[0] += 1
+            _totals[1] += self.errorcount
+            _totals[2] += self.warningcount
+        FlushLog()
+        return False
+
+#------------------------------------------------------------------------------
+# debug sampling
+# If enabled, only a fraction of the requests (and all requests of debug 
+# users) log at DEBUG_LEVEL, all others at a low base level. The level is
+# chosen once, when the requestcontext is created.
+#------------------------------------------------------------------------------
+_sampling = None    # (fraction, baselevel, debugusers) if sampling is enabled
+_sampling_random = random.Random()
+
+def SetDebugSampling(fraction, baselevel=1, debugusers=[]):
+    #--------------------------------------------------------------------------
+    # 'fraction' of the requests (0.0..1.0) and all requests of the user ids
+    # in 'debugusers' log at DEBUG_LEVEL, all others at 'baselevel'
+    #--------------------------------------------------------------------------
+    global _sampling
+    _sampling = (fraction, baselevel, frozenset(debugusers))
+
+def DisableDebugSampling():
+    global _sampling
+    _sampling = None
+
+def _sample_debuglevel(userid):
+    # debug level of a new request, None if sampling is not enabled
+    if _sampling is None: return None
+    (fraction, baselevel, debugusers) = _sampling
+    if userid in debugusers or _sampling_random.random() < fraction:
+        return DEBUG_LEVEL
+    return baselevel
+
+def EnableRequestDebug():
+    #--------------------------------------------------------------------------
+    # switches the active request to full debug output, e.g. when the user 
+    # profile shows a debug user
+    #--------------------------------------------------------------------------
+    GetRequestContext().debuglevel = DEBUG_LEVEL
+
+_local = threading.local()
+_default_context = requestcontext()
+_totals_lock = threading.Lock()
+_totals = [0, 0, 0]   # requests, errors, warnings of all finished contexts
+
+def GetRequestContext():
+    #--------------------------------------------------------------------------
+    # returns the request context active in the current thread
+    #--------------------------------------------------------------------------
+    context = getattr(_local, "context", None)
+    if context is None: return _default_context
+    return context
+
+def GetTotalCounters():
+    #--------------------------------------------------------------------------
+    # returns [requests, errors, warnings] summed over all finished 
+    # request contexts of all threads
+    #--------------------------------------------------------------------------
+    with _totals_lock:
+        return list(_totals)
+
+def ResetTotalCounters():
+    with _totals_lock:
+        _totals[:] = [0, 0, 0]
+
 def ResetErrorCounters():
     #--------------------------------------------------------------------------
-    # resets error and warning counter
+    # resets error and warning counter (of the active request context)
     #--------------------------------------------------------------------------
-    global  warningcount
-    global  errorcount
-    global final_state
-    errorcount = 0
-    warningcount = 0
-    final_state = ""
+    context = GetRequestContext()
+    context.errorcount = 0
+    context.warningcount = 0
+    context.final_state = ""
 
 def SetDebugLevel(level):
     #--------------------------------------------------------------------------
@@ -46,48 +148,310 @@ def GetDebugLevel():
 def GetErrorCounters():
     #--------------------------------------------------------------------------
     # return array with number of errors and number of warnings
+    # (of the active request context)
     #--------------------------------------------------------------------------
-    return [errorcount, warningcount]
+    context = GetRequestContext()
+    return [context.errorcount, context.warningcount]
 
 def ReportDialogState(state_id):
     #--------------------------------------------------------------------------
     # allows the application to log a dialog state, which can be retrieved via GetFinalState
     # This can be used to validate dialog results against expected result for batch testing
     #--------------------------------------------------------------------------
-    global final_state
     debug(2,"Dialog state reported: '"+str(state_id)+"'")
-    final_state = str(state_id)
+    GetRequestContext().final_state = str(state_id)
   
 def GetDialogState():
     #--------------------------------------------------------------------------
     # Returns the Finalallows the application to log a dialog state, which can be retrieved via GetFinalState
     # This can be used to validate dialog results against expected result for batch testing
     #--------------------------------------------------------------------------
-    global final_state
-    return final_state
+    return GetRequestContext().final_state
+
+def _format(text, args):
+    #--------------------------------------------------------------------------
+    # creates the message text from a string, a format string with 
+    # arguments ("%s" style) or a callable returning the text
+    #--------------------------------------------------------------------------
+    if args: return text % args
+    if callable(text): return text()
+    return text
+
+def IsDebugEnabled(level):
+    #--------------------------------------------------------------------------
+    # returns True if debug messages of 'level' are printed
+    # use this to skip debug code in hot loops entirely
+    #--------------------------------------------------------------------------
+    if _sampling is None: return level <= DEBUG_LEVEL
+    return level <= _request_debuglevel()
+
+def _request_debuglevel():
+    debuglevel = GetRequestContext().debuglevel
+    if debuglevel is None: return DEBUG_LEVEL
+    return debuglevel
+
+#------------------------------------------------------------------------------
+# log sinks
+# A sink receives all messages via Write(level, debuglevel, text, fields)
+# ('level' is "error", "warning" or "debug") and Flush() at the end of
+# a request. printsink (default) prints one line per message.
+#------------------------------------------------------------------------------
+class printsink:
+    def Write(self, level, debuglevel, text, fields):
+        if level == "debug": print("  Debug ("+str(debuglevel)+"): "+ text)
+        elif level == "error": print (" ERROR: " + text)
+        else: print (" WARNING: " + text)
+
+    def Flush(self):
+        pass
+
+class jsonlinesink:
+    #--------------------------------------------------------------------------
+    # writes one JSON record per message to 'stream' (default: stdout):
+    # {"ts": .., "level": .., "request_id": .., "span": .., "msg": .., FIELDS}
+    # Records are buffered and written in one block when 'buffersize'
+    # records are collected or the sink is flushed (end of request)
+    #--------------------------------------------------------------------------
+    usesspans = True  # spans are tracked even if timing is disabled
+
+    def __init__(self, stream=None, buffersize=100):
+        self.stream = stream
+        self.buffersize = buffersize
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    def Write(self, level, debuglevel, text, fields):
+        record = {"ts": round(time.time(), 3), "level": level, 
+                  "request_id": GetRequestContext().request_id, 
+                  "span": getattr(_local, "span", "")}
+        if level == "debug": record["debuglevel"] = debuglevel
+        record.update(fields)
+        record["msg"] = text
+        try:
+            line = json.dumps(record, default=str)
+        except UnicodeDecodeError:
+            record["msg"] = repr(text)
+            line = json.dumps(record, default=repr)
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) < self.buffersize: return
+            lines = self._buffer
+            self._buffer = []
+        self._write(lines)
+
+    def Flush(self):
+        with self._lock:
+            lines = self._buffer
+            self._buffer = []
+        if lines: self._write(lines)
+
+    def _write(self, lines):
+        stream = self.stream
+        if stream is None: stream = sys.stdout
+        stream.write("\n".join(lines) + "\n")
+        stream.flush()
+
+_sink = printsink()
+
+def SetLogSink(sink):
+    #--------------------------------------------------------------------------
+    # sets the sink for all messages. Returns the previous sink (flushed)
+    #--------------------------------------------------------------------------
+    global _sink
+    global _track_spans
+    previous = _sink
+    previous.Flush()
+    _sink = sink
+    _track_spans = getattr(sink, "usesspans", False)
+    return previous
+
+def GetLogSink():
+    return _sink
+
+def FlushLog():
+    #--------------------------------------------------------------------------
+    # writes buffered messages, call at the end of each request
+    # (done automatically when a requestcontext block is left and at exit)
+    #--------------------------------------------------------------------------
+    _sink.Flush()
 
-def error(text):
+atexit.register(FlushLog)
+
+def error(text, *args, **fields):
     #--------------------------------------------------------------------------
     # prints error message ad increments errorcount
+    # 'fields': additional key/values for structured sinks
     #--------------------------------------------------------------------------
-    global  errorcount
-    print (" ERROR: " + text)
-    errorcount += 1
+    _sink.Write("error", 0, _format(text, args), fields)
+    GetRequestContext().errorcount += 1
 
-def warning(text):
+def warning(text, *args, **fields):
     #--------------------------------------------------------------------------
     # prints warning message ad increments warningcount
+    # 'fields': additional key/values for structured sinks
     #--------------------------------------------------------------------------
-    global  warningcount#
-    print (" WARNING: " + text)
-    warningcount += 1
+    _sink.Write("warning", 0, _format(text, args), fields)
+    GetRequestContext().warningcount += 1
 
-def debug(level, text):
+def debug(level, text, *args, **fields):
     #--------------------------------------------------------------------------
     # prints debug message if level <= DEBUG_LEVEL
+    # (and <= the level of the request if debug sampling is enabled)
+    # 'text' can be a string, a format string for 'args' (e.g. 
+    # debug(5, "SLOTS: %s", slots)) or a callable returning the text.
+    # Formatting and the callable are only evaluated if the level is enabled
+    # 'fields': additional key/values for structured sinks
+    #--------------------------------------------------------------------------
+    if level > DEBUG_LEVEL: return
+    if _sampling is None or level <= _request_debuglevel():
+        _sink.Write("debug", level, _format(text, args), fields)
+
+#------------------------------------------------------------------------------
+# timing spans
+# Named spans measure the time of a code block (with span("name"):) or of
+# a function (@timed("name")). The times are collected in a histogram per 
+# span name, DumpTimings prints the percentiles.
+# Timing is off by default; then a span costs one flag check.
+#------------------------------------------------------------------------------
+TIMING_ENABLED = False
+# span names are also tracked without timing if the sink writes them
+_track_spans = False
+
+# upper bounds of the histogram buckets in ms: 0.001 ms .. ~67 s, factor 2^(1/4)
+TIMING_BUCKETS = [0.001 * 2 ** (i / 4.0) for i in range(105)]
+
+_timings = {}   # span name -> [count, total ms, max ms, bucket counts]
+_timings_lock = threading.Lock()
+
+def EnableTiming(enabled=True):
+    global TIMING_ENABLED
+    TIMING_ENABLED = enabled
+
+def _bucket_index(ms):
+    # TIMING_BUCKETS is geometric, so the bucket can be computed directly
+    if ms <= TIMING_BUCKETS[0]: return 0
+    index = int(math.ceil(4 * math.log(ms / TIMING_BUCKETS[0], 2) - 1e-9))
+    return min(index, len(TIMING_BUCKETS) - 1)
+
+def RecordTiming(name, ms):
+    #--------------------------------------------------------------------------
+    # adds a measurement of 'ms' milliseconds to the histogram of span 'name'
+    #--------------------------------------------------------------------------
+    index = _bucket_index(ms)
+    with _timings_lock:
+        data = _timings.get(name)
+        if data is None:
+            data = [0, 0.0, 0.0, [0] * len(TIMING_BUCKETS)]
+            _timings[name] = data
+        data[0] += 1
+        data[1] += ms
+        if ms > data[2]: data[2] = ms
+        data[3][index] += 1
+
+class _span:
+    def __init__(self, name):
+        self.name = name
+        self.start = 0
+        self.previous = ""
+
+    def __enter__(self):
+        # the innermost span is added to structured log records
+        self.previous = getattr(_local, "span", "")
+        _local.span = self.name
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        RecordTiming(self.name, (time.time() - self.start) * 1000.0)
+        _local.span = self.previous
+        return False
+
+class _namedspan:
+    # sets the span name for log records only (timing disabled)
+    def __init__(self, name):
+        self.name = name
+        self.previous = ""
+
+    def __enter__(self):
+        self.previous = getattr(_local, "span", "")
+        _local.span = self.name
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.span = self.previous
+        return False
+
+class _nospan:
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc_value, traceback): return False
+
+_NOSPAN = _nospan()
+
+def span(name):
+    #--------------------------------------------------------------------------
+    # context manager measuring the time of a code block:
+    #     with myask_log.span("fetch stations"):
+    #         ...
+    #--------------------------------------------------------------------------
+    if TIMING_ENABLED: return _span(name)
+    if _track_spans: return _namedspan(name)
+    return _NOSPAN
+
+def timed(name):
+    #--------------------------------------------------------------------------
+    # decorator measuring the time of each call of a function or method
+    #--------------------------------------------------------------------------
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not TIMING_ENABLED and not _track_spans: 
+                return function(*args, **kwargs)
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _percentile(buckets, count, fraction):
+    # upper bound of the bucket containing the given fraction of the values
+    limit = fraction * count
+    cumulated = 0
+    for index in xrange(len(buckets)):
+        cumulated += buckets[index]
+        if cumulated >= limit: return TIMING_BUCKETS[index]
+    return TIMING_BUCKETS[-1]
+
+def GetTimings():
+    #--------------------------------------------------------------------------
+    # returns {span name: {count, mean, p50, p90, p99, max}} (times in ms)
+    # percentiles are the upper bound of their histogram bucket (+-10%)
+    #--------------------------------------------------------------------------
+    result = {}
+    with _timings_lock:
+        for name in _timings:
+            (count, total, maximum, buckets) = _timings[name]
+            result[name] = {"count": count, "mean": total / count, "max": maximum,
+                            "p50": min(_percentile(buckets, count, 0.5), maximum),
+                            "p90": min(_percentile(buckets, count, 0.9), maximum),
+                            "p99": min(_percentile(buckets, count, 0.99), maximum)}
+    return result
+
+def ResetTimings():
+    with _timings_lock:
+        _timings.clear()
+
+def DumpTimings(reset=True):
+    #--------------------------------------------------------------------------
+    # prints count and latency percentiles of all spans, e.g. at the end of an
+    # invocation or a test run. Resets the histograms if 'reset' is True
     #--------------------------------------------------------------------------
-    if level <= DEBUG_LEVEL:
-        print("  Debug ("+str(level)+"): "+ text)
+    timings = GetTimings()
+    if reset: ResetTimings()
+    if not timings: return
+    print("Timings (ms):")
+    print("  {:<40} {:>8} {:>9} {:>9} {:>9} {:>9} {:>9}".format("span", "count", "mean", "p50", "p90", "p99", "max"))
+    for name in sorted(timings):
+        t = timings[name]
+        print("  {:<40} {:>8} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}".format(name, t["count"], t["mean"], t["p50"], t["p90"], t["p99"], t["max"]))
 
 def main():
     error("This module does not offer command line functionality")
@@ -14,12 +14,44 @@
 
 import myask_log
 import re
-from datetime import datetime, date, timedelta
+import json
+import weakref
+import threading
+from UserDict import DictMixin
+from collections import OrderedDict
+from datetime import datetime, date, time, timedelta
+try:
+    import pytz
+except ImportError:
+    pytz = None
 
 CONST_UNDEF_DURATION = 999
 FAKEDATE_EVENT_NOT_FOUND = "1988-01-01"
 FAKEDATE_CALENDAR_NOT_FOUND = "1999-01-01"
 
+# input locale -> (language, time zone)
+LOCALES = {
+    "de-DE":   ("de-DE", "Europe/Berlin"),
+    "deu_deu": ("de-DE", "Europe/Berlin"),
+    "en-US":   ("en-US", "America/New_York"),
+    "en-GB":   ("en-GB", "Europe/London")
+}
+
+# time zone -> (utc offset of standard time in hours, daylight saving time rule)
+# other time zone names (e.g. the device time zone) need pytz
+TIMEZONES = {
+    "UTC":                 (0, None),
+    "Europe/London":       (0, "EU"),
+    "Europe/Dublin":       (0, "EU"),
+    "Europe/Berlin":       (1, "EU"),
+    "Europe/Vienna":       (1, "EU"),
+    "Europe/Zurich":       (1, "EU"),
+    "America/New_York":    (-5, "US"),
+    "America/Chicago":     (-6, "US"),
+    "America/Denver":      (-7, "US"),
+    "America/Los_Angeles": (-8, "US")
+}
+
 
 def error_slots_missing(function_name):
     myask_log.error("Slot missing in function " + function_name)
@@ -39,72 +71,233 @@ def checkslots(slots, checklist, functionname):
             return False
     return True
 
-def store_session_slots(intent, slotlist, slots):
+#-------------------------------------------------------------------------------
+# session attribute codec
+# Slot values are stored in the session attributes as tagged strings:
+#   "D:2017-05-01"         date
+#   "I:42"                 int
+#   "F:4.2"                float
+#   "B:1"                  bool
+#   "L:[...]" / "M:{...}"  list / dict (JSON, dates as {"$date": "2017-05-01"})
+#   "C:RED|rot"            canonical + literal of a slot (slotname, slotname.literal)
+#   "S:..."                string that would otherwise look like a tagged value
+# all other strings are stored unchanged. 
+# Decoding only looks at the first two characters of a value. 
+# Values written by older versions ("DATE:2017-05-01") are still read.
+#-------------------------------------------------------------------------------
+
+# maximum size of all session attributes created by store_session_slots
+SESSION_BYTE_BUDGET = 6000
+
+def _decode_date(payload):
+    return date(int(payload[0:4]), int(payload[5:7]), int(payload[8:10]))
+
+def _encode_json_default(val):
+    # dates in lists and dicts
+    if isinstance(val, date):
+        return {"$date": val.strftime('%Y-%m-%d')}
+    raise TypeError(repr(val) + " is not JSON serializable")
+
+def _decode_json_object(obj):
+    if len(obj) == 1 and "$date" in obj:
+        return _decode_date(obj["$date"])
+    return obj
+
+def _decode_json(payload):
+    return json.loads(payload, object_hook=_decode_json_object)
+
+_SESSION_DECODERS = {
+    "D:": _decode_date,
+    "I:": int,
+    "F:": float,
+    "B:": lambda payload: payload == "1",
+    "L:": _decode_json,
+    "M:": _decode_json,
+    "S:": lambda payload: payload
+}
+
+def encode_session_value(val):
+    #---------------------------------------------------------------------------
+    # returns the tagged session attribute string for a slot value
+    #---------------------------------------------------------------------------
+    if isinstance(val, date):
+        return "D:"+val.strftime('%Y-%m-%d')
+    elif isinstance(val, bool):
+        if val: return "B:1"
+        else: return "B:0"
+    elif isinstance(val, (int, long)):
+        return "I:"+str(val)
+    elif isinstance(val, float):
+        return "F:"+repr(val)
+    elif isinstance(val, (list, dict)):
+        if isinstance(val, list): tag = "L:"
+        else: tag = "M:"
+        try:
+            return tag+json.dumps(val, separators=(',', ':'), default=_encode_json_default)
+        except (TypeError, ValueError) as e:
+            myask_log.warning("encode_session_value: cannot encode value as JSON ("+str(e)+"), stored as string")
+            val = str(val)
+    if not isinstance(val, basestring):
+        val = str(val)
+    if val[:2] in _SESSION_DECODERS or val[:2] == "C:" or val.startswith("DATE:"):
+        return "S:"+val
+    return val
+
+def decode_session_attribute(slots, name, value):
+    #---------------------------------------------------------------------------
+    # decodes the session attribute 'name' and stores the value(s) in slots
+    #---------------------------------------------------------------------------
+    if not isinstance(value, basestring):
+        slots[name] = value
+        return
+    tag = value[:2]
+    decoder = _SESSION_DECODERS.get(tag)
+    try:
+        if decoder is not None:
+            slots[name] = decoder(value[2:])
+        elif tag == "C:":
+            (slots[name], slots[name+".literal"]) = value[2:].split("|", 1)
+        elif value.startswith("DATE:"):
+            slots[name] = datetime.strptime(value, "DATE:%Y-%m-%d").date()
+        else:
+            slots[name] = value
+    except ValueError:
+        myask_log.error("decode_session_attribute: invalid value '"+value+"' for session attribute '"+name+"'")
+        slots[name] = value
+
+def _get_attribute_size(name, value):
+    # approximate size of a session attribute in the JSON response
+    if isinstance(value, unicode): value = value.encode("utf-8")
+    return len(name) + len(value) + 6
+
+def store_session_slots(intent, slotlist, slots, budget=SESSION_BYTE_BUDGET):
 
 # Stores selected information from the current state in the session cookie
 # This info will be available next time
 # intent: name of the active intent ("" if none)
 # slotlist: list of slotnames, for which the infor shall be stored
 # slots current slot values
+# budget: maximum size of the session attributes in bytes. Slots that do not
+#         fit any more are not stored (a warning is logged)
 #-------------------------------------------------------------------------------
 
-    myask_log.debug(3, "storing session attributes for intent "+str(intent))
+    myask_log.debug(3, "storing session attributes for intent %s", intent)
     session_attributes = {}
-    if intent != "": session_attributes['prev_intent'] = intent
+    size = 0
+    if intent != "": 
+        session_attributes['prev_intent'] = encode_session_value(intent)
+        size += _get_attribute_size('prev_intent', session_attributes['prev_intent'])
         
     for slotname in slotlist:
         if slotname in slots:
             val =  slots[slotname]
-            slottype = type(val)
-            if isinstance(val, datetime):
-                session_attributes[slotname] = "DATE:"+val.strftime('%Y-%m-%d')
-            elif isinstance(val, date):
-                session_attributes[slotname] = "DATE:"+val.strftime('%Y-%m-%d')
-            elif slottype == list:
-                # todo: print/read sequence
-                session_attributes[slotname] = str(slots[slotname])
-            elif slottype == int:
-                session_attributes[slotname] = str(slots[slotname])
+            literalname = slotname+".literal"
+            attributes = []
+            if literalname in slots and isinstance(val, basestring) and "|" not in val and isinstance(slots[literalname], basestring):
+                attributes.append((slotname, "C:"+val+"|"+slots[literalname]))
             else:
-                session_attributes[slotname] = str(slots[slotname])
-            
-            if slotname+".literal" in slots:
-                session_attributes[slotname+".literal"] = slots[slotname+".literal"]
+                attributes.append((slotname, encode_session_value(val)))
+                if literalname in slots:
+                    attributes.append((literalname, encode_session_value(slots[literalname])))
+
+            attributesize = 0
+            for (name, value) in attributes: 
+                attributesize += _get_attribute_size(name, value)
+            if size + attributesize > budget:
+                myask_log.warning("store_session_slots: session attribute budget of "+str(budget)+" bytes exceeded, '"+slotname+"' not stored")
+                continue
+            size += attributesize
+            for (name, value) in attributes:
+                session_attributes[name] = value
                 
     return session_attributes  
 
-def readAmazonDate(date_str):
-    #check for exact date e.g. 2015-11-25.
-    if re.match("\d\d\d\d-\d\d-\d\d$", date_str): 
-        start_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-        duration = 1
-    #check for weekend e.g. 2015-W49-WE
-    elif re.match("\d\d\d\d-W\d\d-WE$", date_str): 
-        tmp_str = date_str[:-3]
-        tmp_str = tmp_str+ ":6"
-        start_date = datetime.strptime(tmp_str, "%Y-W%W:%w").date()
-        duration = 2
-    #check for week e.g. 2015-W49
-    elif re.match("\d\d\d\d-W\d+$", date_str): 
-        tmp_str= date_str+":0"
-        start_date = datetime.strptime(tmp_str, "%Y-W%W:%w").date()
-        duration = 7
-    #check for month e.g. 2015-12
-    elif re.match("\d\d\d\d-\d+$", date_str): 
-        tmp_str= date_str +"-01"
-        start_date = datetime.strptime(tmp_str, "%Y-%m-%d").date()
-        duration = 30
-    #check for year e.g. 2015
-    elif re.match("\d\d\d\d$", date_str): 
-        tmp_str= date_str+"-01-01"
-        start_date = datetime.strptime(tmp_str, "%Y-%m-%d").date()
-        duration = 365
-    #handle unknown dates
-    else:
+#-------------------------------------------------------------------------------
+# AMAZON.DATE 
+#-------------------------------------------------------------------------------
+# all formats of AMAZON.DATE in one pattern:
+#   2015-11-25 (day), 2015-W48 (week), 2015-W48-WE (weekend), 2015-11 (month),
+#   2015 (year), 201X (decade), 2017-WI (season: WI, SP, SU, FA),
+#   XXXX-11-25 (day without year), PRESENT_REF (now)
+_AMAZON_DATE_PATTERN = re.compile(
+    r"^(?:(?P<year>\d{4})(?:-(?:W(?P<week>\d{1,2})(?P<weekend>-WE)?|(?P<season>WI|SP|SU|FA)|(?P<month>\d{1,2})(?:-(?P<day>\d{1,2}))?))?"
+    r"|(?P<decade>\d{3})X"
+    r"|XXXX-(?P<anymonth>\d{1,2})-(?P<anyday>\d{1,2})"
+    r"|(?P<present>PRESENT_REF))$")
+
+# season -> (first month, duration)
+AMAZON_SEASONS = {
+    "SP": (3, 92),
+    "SU": (6, 92),
+    "FA": (9, 91),
+    "WI": (12, 90)
+}
+
+# parsed AMAZON.DATE values, least recently used entries are removed first
+_amazon_date_cache = OrderedDict()
+_amazon_date_lock = threading.Lock() # handlers may run in several threads
+AMAZON_DATE_CACHE_SIZE = 256
+
+def _get_isoweek_start(year, week):
+    # returns the monday of ISO week 'week' (week 1 contains January 4th)
+    january4 = date(year, 1, 4)
+    return january4 - timedelta(january4.weekday()) + timedelta(weeks=week-1)
+
+def _parse_amazon_date(date_str, timezone):
+    # parses an AMAZON.DATE value, returns (start_date, duration) or None
+    match = _AMAZON_DATE_PATTERN.match(date_str)
+    if match is None:
+        return None
+    year = match.group('year')
+    if year is not None:
+        year = int(year)
+        if match.group('day') is not None:
+            return (date(year, int(match.group('month')), int(match.group('day'))), 1)
+        if match.group('month') is not None:
+            return (date(year, int(match.group('month')), 1), 30)
+        if match.group('week') is not None:
+            start_date = _get_isoweek_start(year, int(match.group('week')))
+            if match.group('weekend') is not None:
+                return (start_date + timedelta(5), 2)
+            return (start_date, 7)
+        if match.group('season') is not None:
+            (month, duration) = AMAZON_SEASONS[match.group('season')]
+            return (date(year, month, 1), duration)
+        return (date(year, 1, 1), 365)
+    if match.group('decade') is not None:
+        return (date(int(match.group('decade'))*10, 1, 1), 3652)
+    today = get_today(timezone)
+    if match.group('anymonth') is not None:
+        # next occurrence of this day
+        start_date = date(today.year, int(match.group('anymonth')), int(match.group('anyday')))
+        if start_date < today:
+            start_date = date(today.year+1, start_date.month, start_date.day)
+        return (start_date, 1)
+    return (today, 1) # PRESENT_REF
+
+def readAmazonDate(date_str, timezone=None):
+    # translates an AMAZON.DATE value into a date + duration information
+    # timezone: time zone name of the request (None: local time zone), used 
+    #           for values relative to the current date (PRESENT_REF, XXXX-..)
+    with _amazon_date_lock:
+        result = _amazon_date_cache.pop(date_str, None)
+        if result is not None:
+            _amazon_date_cache[date_str] = result
+            return result
+    try:
+        result = _parse_amazon_date(date_str, timezone)
+    except ValueError: # e.g. month 13
+        result = None
+    if result is None:
         myask_log.error(" unknown date format '" + date_str +"'")
-        start_date = date.today() 
-        duration = CONST_UNDEF_DURATION
-    return (start_date, duration)
+        return (get_today(timezone), CONST_UNDEF_DURATION)
+    if date_str.startswith("X") or date_str == "PRESENT_REF":
+        return result # depends on the current date
+    with _amazon_date_lock:
+        if len(_amazon_date_cache) >= AMAZON_DATE_CACHE_SIZE:
+            _amazon_date_cache.popitem(last=False)
+        _amazon_date_cache[date_str] = result
+    return result
 
 
 
@@ -124,180 +317,312 @@ def weekday_nextweek(d, weekday):
     next_week_start = next_weekday(d, 0)
     return next_week_start + timedelta(weekday)
 
-def get_startofmonth(month):
+def get_startofmonth(month, today=None):
     # returns the 1st day of the specified month. If the month has already passe, use next year
-    today =  date.today()
+    if today is None: today =  date.today()
     if today.month <= month:
         year = today.year
     else:
         year = today.year +1
     return date(year, month, 1)
-   
-def readMyRelativeDate(date_canon):
-    today =  date.today()
-    # translates a canonicalized relative date into a date + duration information
-    if(date_canon =="?"):
-        myask_log.warning("undefined relative date canonical '?'. Using current date")
-        start_date = today
-        duration = CONST_UNDEF_DURATION
-    elif  (date_canon =="TODAY"):
-        start_date = today
-        duration = 1       
-    elif(date_canon =="TOMORROW"):
-        start_date = today + timedelta(1)
-        duration = 1       
-    elif(date_canon =="DAY_AFTER_TOMORROW"):
-        start_date = today+ timedelta(2)
-        duration = 1       
-    elif(date_canon =="THIS_WEEK"):
-        # define this week as today + <= 7days
-        start_date = today
-        duration = 7       
-    elif(date_canon =="NEXT_WEEK"):
-        # return next sunday +- 1 week later
-        start_date = this_weekday(today, 0)
-        duration = 7               
-    elif(date_canon =="WEEK_AFTER_NEXT"):
-        # return next sunday+7 +- 1 week later
-        start_date = this_weekday(today+timedelta(7), 0)
-        duration = 7               
-    elif(date_canon =="MONDAY"):
-        start_date = this_weekday(today, 0)
-        duration = 1               
-    elif(date_canon =="TUESDAY"):
-        start_date = this_weekday(today, 1)
-        duration = 1               
-    elif(date_canon =="WEDNESDAY"):
-        start_date = this_weekday(today, 2)
-        duration = 1               
-    elif(date_canon =="THURSDAY"):
-        start_date = this_weekday(today, 3)
-        duration = 1               
-    elif(date_canon =="FRIDAY"):
-        start_date = this_weekday(today, 4)
-        duration = 1               
-    elif(date_canon =="SATURDAY"):
-        start_date = this_weekday(today, 5)
-        duration = 1               
-    elif(date_canon =="SUNDAY"):
-        start_date = this_weekday(today, 6)
-        duration = 1               
-    elif(date_canon =="NEXT_MONDAY"):
-        start_date = next_weekday(today, 0)
-        duration = 1               
-    elif(date_canon =="NEXT_TUESDAY"):
-        start_date = next_weekday(today, 1)
-        duration = 1               
-    elif(date_canon =="NEXT_WEDNESDAY"):
-        start_date = next_weekday(today, 2)
-        duration = 1               
-    elif(date_canon =="NEXT_THURSDAY"):
-        start_date = next_weekday(today, 3)
-        duration = 1               
-    elif(date_canon =="NEXT_FRIDAY"):
-        start_date = next_weekday(today, 4)
-        duration = 1               
-    elif(date_canon =="NEXT_SATURDAY"):
-        start_date = next_weekday(today, 5)
-        duration = 1               
-    elif(date_canon =="NEXT_SUNDAY"):
-        start_date = next_weekday(today, 6)
-        duration = 1               
-    elif(date_canon =="MONDAY_NEXTWEEK"):
-        start_date = weekday_nextweek(today, 0)
-        duration = 1               
-    elif(date_canon =="TUESDAY_NEXTWEEK"):
-        start_date = weekday_nextweek(today, 1)
-        duration = 1               
-    elif(date_canon =="WEDNESDAY_NEXTWEEK"):
-        start_date = weekday_nextweek(today, 2)
-        duration = 1               
-    elif(date_canon =="THURSDAY_NEXTWEEK"):
-        start_date = weekday_nextweek(today, 3)
-        duration = 1               
-    elif(date_canon =="FRIDAY_NEXTWEEK"):
-        start_date = weekday_nextweek(today, 4)
-        duration = 1               
-    elif(date_canon =="SATURDAY_NEXTWEEK"):
-        start_date = weekday_nextweek(today, 5)
-        duration = 1               
-    elif(date_canon =="SUNDAY_NEXTWEEK"):
-        start_date = weekday_nextweek(today, 6)
-        duration = 1               
-    elif(date_canon =="MONTH_JAN"):
-        start_date = get_startofmonth(1)
-        duration = 31               
-    elif(date_canon =="MONTH_FEB"):
-        start_date = get_startofmonth(2)
-        duration = 29               
-    elif(date_canon =="MONTH_MAR"):
-        start_date = get_startofmonth(3)
-        duration = 31               
-    elif(date_canon =="MONTH_APR"):
-        start_date = get_startofmonth(4)
-        duration = 30               
-    elif(date_canon =="MONTH_MAY"):
-        start_date = get_startofmonth(5)
-        duration = 31               
-    elif(date_canon =="MONTH_JUN"):
-        start_date = get_startofmonth(6)
-        duration = 30               
-    elif(date_canon =="MONTH_JUL"):
-        start_date = get_startofmonth(7)
-        duration = 31               
-    elif(date_canon =="MONTH_AUG"):
-        start_date = get_startofmonth(8)
-        duration = 31               
-    elif(date_canon =="MONTH_SEP"):
-        start_date = get_startofmonth(9)
-        duration = 30               
-    elif(date_canon =="MONTH_OCT"):
-        start_date = get_startofmonth(10)
-        duration = 31               
-    elif(date_canon =="MONTH_NOV"):
-        start_date = get_startofmonth(11)
-        duration = 30              
-    elif(date_canon =="MONTH_DEC"):
-        start_date = get_startofmonth(12)
-        duration = 31               
+
+def _get_sunday(year, month, n):
+    # returns the n-th sunday of the month (n=-1: last sunday)
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta((6 - first.weekday()) % 7 + 7*(n-1))
+    if month == 12: last = date(year, 12, 31)
+    else: last = date(year, month+1, 1) - timedelta(1)
+    return last - timedelta((last.weekday() - 6) % 7)
+
+def _is_dst(utcnow, std_offset, rule):
+    # True if daylight saving time is active at 'utcnow' (UTC)
+    year = utcnow.year
+    if rule == "EU":   # last sunday of march until last sunday of october, 01:00 UTC
+        start = datetime.combine(_get_sunday(year, 3, -1), time(1))
+        end = datetime.combine(_get_sunday(year, 10, -1), time(1))
+    elif rule == "US": # second sunday of march until first sunday of november, 02:00 local time
+        start = datetime.combine(_get_sunday(year, 3, 2), time(0)) + timedelta(hours=2-std_offset)
+        end = datetime.combine(_get_sunday(year, 11, 1), time(0)) + timedelta(hours=1-std_offset)
     else:
-        myask_log.error("invalid relative date canonical '"+date_canon+"'")
-        start_date = date.today() 
-        duration = CONST_UNDEF_DURATION
-     
-    return (start_date, duration)
+        return False
+    return start <= utcnow < end
 
+def get_utc_offset(timezone, utcnow=None):
+    # returns the offset to UTC (hours) of time zone 'timezone' at 'utcnow' (UTC)
+    # returns None if the time zone is unknown
+    if utcnow is None: utcnow = datetime.utcnow()
+    if timezone in TIMEZONES:
+        (std_offset, rule) = TIMEZONES[timezone]
+        if _is_dst(utcnow, std_offset, rule): return std_offset + 1
+        return std_offset
+    if pytz is not None:
+        try:
+            # utcnow is UTC, so localize it as UTC (not as local time of the zone)
+            offset = pytz.utc.localize(utcnow).astimezone(pytz.timezone(timezone)).utcoffset()
+        except pytz.UnknownTimeZoneError:
+            return None
+        return offset.days*24 + offset.seconds/3600.0
+    return None
 
-def readMyYear(date_canon):
-    this_year =  int(date.today().strftime("%Y"))
-    
+def get_today(timezone=None):
+    # returns the current date in the time zone of the request (e.g. "Europe/Berlin")
+    # if timezone is None or unknown, the local time zone of the process is used
+    if timezone is None:
+        return date.today()
+    utcnow = datetime.utcnow()
+    utc_offset = get_utc_offset(timezone, utcnow)
+    if utc_offset is None:
+        myask_log.error("Unknown time zone '"+timezone+"'. Using local time zone")
+        return date.today()
+    return (utcnow + timedelta(hours=utc_offset)).date()
+
+#-------------------------------------------------------------------------------
+# relative date canonical -> (function(today) returning the start date, duration)
+#-------------------------------------------------------------------------------
+RELATIVE_DATES = {
+    "TODAY":              (lambda today: today, 1),
+    "TOMORROW":           (lambda today: today + timedelta(1), 1),
+    "DAY_AFTER_TOMORROW": (lambda today: today + timedelta(2), 1),
+    # define this week as today + <= 7days
+    "THIS_WEEK":          (lambda today: today, 7),
+    # return next sunday +- 1 week later
+    "NEXT_WEEK":          (lambda today: this_weekday(today, 0), 7),
+    # return next sunday+7 +- 1 week later
+    "WEEK_AFTER_NEXT":    (lambda today: this_weekday(today+timedelta(7), 0), 7)
+}
+for (weekday, dayname) in enumerate(["MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "FRIDAY", "SATURDAY", "SUNDAY"]):
+    RELATIVE_DATES[dayname] = (lambda today, weekday=weekday: this_weekday(today, weekday), 1)
+    RELATIVE_DATES["NEXT_"+dayname] = (lambda today, weekday=weekday: next_weekday(today, weekday), 1)
+    RELATIVE_DATES[dayname+"_NEXTWEEK"] = (lambda today, weekday=weekday: weekday_nextweek(today, weekday), 1)
+for (month, (monthname, duration)) in enumerate([("JAN", 31), ("FEB", 29), ("MAR", 31), ("APR", 30), ("MAY", 31), ("JUN", 30),
+                                                  ("JUL", 31), ("AUG", 31), ("SEP", 30), ("OCT", 31), ("NOV", 30), ("DEC", 31)]):
+    RELATIVE_DATES["MONTH_"+monthname] = (lambda today, month=month+1: get_startofmonth(month, today), duration)
+
+# relative year canonical -> offset to the current year
+RELATIVE_YEARS = {
+    "THIS_YEAR": 0,
+    "NEXT_YEAR": 1,
+    "TWO_YEARS": 2
+}
+_YEAR_PATTERN = re.compile(r"\d\d\d\d$")
+
+# resolved relative dates: (canonical, time zone, today) -> (start_date, duration)
+# the result only changes once a day, 'today' is already in the time zone of the request
+_relative_date_cache = {}
+RELATIVE_DATE_CACHE_SIZE = 1000
+
+def _cache_relative_date(key, result):
+    if len(_relative_date_cache) >= RELATIVE_DATE_CACHE_SIZE:
+        _relative_date_cache.clear()
+    _relative_date_cache[key] = result
+    return result
+
+def readMyRelativeDate(date_canon, timezone=None):
     # translates a canonicalized relative date into a date + duration information
+    # timezone: time zone name of the request (None: local time zone)
+    today = get_today(timezone)
+    key = (date_canon, timezone, today)
+    if key in _relative_date_cache:
+        return _relative_date_cache[key]
+    if date_canon in RELATIVE_DATES:
+        (startfunction, duration) = RELATIVE_DATES[date_canon]
+        return _cache_relative_date(key, (startfunction(today), duration))
+
     if(date_canon =="?"):
         myask_log.warning("undefined relative date canonical '?'. Using current date")
-        year = this_year
-    elif  (date_canon =="THIS_YEAR"):
-        year = this_year
-    elif(date_canon =="NEXT_YEAR"):
-        year = this_year+1
-    elif(date_canon =="TWO_YEARS"):
-        year = this_year+2     
-    elif(re.match("\d\d\d\d$", date_canon)): 
-        year = date_canon       
     else:
         myask_log.error("invalid relative date canonical '"+date_canon+"'")
-        year = this_year
+    return (today, CONST_UNDEF_DURATION)
 
-    tmp_str= str(year)+"-01-01"
-    start_date = datetime.strptime(tmp_str, "%Y-%m-%d").date()
-    duration = 365     
-    return (start_date, duration)
 
+def readMyYear(date_canon, timezone=None):
+    # translates a canonicalized relative year into a date + duration information
+    # timezone: time zone name of the request (None: local time zone)
+    today = get_today(timezone)
+    key = ("YEAR:"+date_canon, timezone, today)
+    if key in _relative_date_cache:
+        return _relative_date_cache[key]
 
+    if date_canon in RELATIVE_YEARS:
+        year = today.year + RELATIVE_YEARS[date_canon]
+    elif _YEAR_PATTERN.match(date_canon): 
+        year = int(date_canon)
+    else:
+        if(date_canon =="?"):
+            myask_log.warning("undefined relative date canonical '?'. Using current date")
+        else:
+            myask_log.error("invalid relative date canonical '"+date_canon+"'")
+        return (date(today.year, 1, 1), 365)
+
+    return _cache_relative_date(key, (date(year, 1, 1), 365))
 
 
+
+#-------------------------------------------------------------------------------
+# slot resolvers
+# A resolver converts the literal of a filled slot into the slot values:
+#   resolver(slots, slotname, literal, appdef, lang)
+# and stores them in 'slots' (slotname and optionally slotname+".literal",
+# slotname+".duration")
+#-------------------------------------------------------------------------------
+
+def resolve_canonical(slots, slotname, literal, appdef, lang):
+    # custom slot type: canonical + literal
+    slots[slotname] = appdef.GetSlotCanonical(slotname, literal, strict=True, locale=lang)
+    slots[slotname+".literal"] = literal
+
+def resolve_relative_date(slots, slotname, literal, appdef, lang):
+    canonical_date = appdef.GetSlotCanonical(slotname, literal, strict=True, locale=lang)
+    (slots[slotname], slots[slotname+'.duration']) = readMyRelativeDate(canonical_date, slots.get('timezone'))
+    slots[slotname+'.literal'] = literal
+
+def resolve_year(slots, slotname, literal, appdef, lang):
+    canonical_date = appdef.GetSlotCanonical(slotname, literal, strict=True, locale=lang)
+    (slots[slotname], slots[slotname+'.duration']) = readMyYear(canonical_date, slots.get('timezone'))
+    slots[slotname+'.literal'] = literal
+
+def resolve_amazon_date(slots, slotname, literal, appdef, lang):
+    (slots[slotname], slots[slotname+'.duration']) = readAmazonDate(literal, slots.get('timezone'))
+    slots[slotname+'.literal'] = literal
+
+def resolve_literal(slots, slotname, literal, appdef, lang):
+    # slot value is used as is
+    slots[slotname] = literal
+
+# slot type -> resolver. Slot types not listed here use resolve_canonical
+SLOT_RESOLVERS = {
+    "MY_RELATIVE_DATE":     resolve_relative_date,
+    "MY_YEARS":             resolve_year,
+    "AMAZON.DATE":          resolve_amazon_date,
+    "AMAZON.NUMBER":        resolve_literal,
+    "AMAZON.DE_FIRST_NAME": resolve_literal
+}
+
+# resolver -> suffixes of the slot keys it sets (used by lazyslots)
+# resolvers not listed here are always evaluated immediately
+SLOT_RESOLVER_KEYS = {
+    resolve_canonical:      ("", ".literal"),
+    resolve_relative_date:  ("", ".duration", ".literal"),
+    resolve_year:           ("", ".duration", ".literal"),
+    resolve_amazon_date:    ("", ".duration", ".literal"),
+    resolve_literal:        ("",)
+}
+
+# compiled slot plans: appdef -> {intent name: {slotname: resolver}}
+_slot_plans = weakref.WeakKeyDictionary()
+
+def RegisterSlotResolver(slottype, resolver, keysuffixes=None):
+    #---------------------------------------------------------------------------
+    # registers the resolver function for slots of type 'slottype'
+    # (replaces the existing resolver for built-in or custom types)
+    # 'keysuffixes': suffixes of all keys the resolver sets, e.g. ("", ".literal")
+    # If given, the resolver can be evaluated lazily (see lazyslots)
+    #---------------------------------------------------------------------------
+    SLOT_RESOLVERS[slottype] = resolver
+    if keysuffixes is not None: 
+        SLOT_RESOLVER_KEYS[resolver] = tuple(keysuffixes)
+    _slot_plans.clear()
+
+def _get_slot_plan(appdef, intentname):
+    #---------------------------------------------------------------------------
+    # returns the slot plan {slotname: resolver} for an intent 
+    # The plan is built once per appdef and intent, from the slots defined for
+    # the intent. Non-application slots are mapped to None
+    #---------------------------------------------------------------------------
+    intentplans = _slot_plans.get(appdef)
+    if intentplans is None:
+        intentplans = {}
+        _slot_plans[appdef] = intentplans
+    plan = intentplans.get(intentname)
+    if plan is None:
+        plan = {}
+        for slotname in appdef.getIntentSlots(intentname):
+            _add_to_slot_plan(plan, appdef, slotname)
+        intentplans[intentname] = plan
+    return plan
+
+def _add_to_slot_plan(plan, appdef, slotname):
+    #---------------------------------------------------------------------------
+    # adds the resolver for slot 'slotname' to the slot plan and returns it
+    #---------------------------------------------------------------------------
+    if appdef.isApplicationSlot(slotname):
+        resolver = SLOT_RESOLVERS.get(appdef.getSlottype(slotname), resolve_canonical)
+    else:
+        resolver = None
+    plan[slotname] = resolver
+    return resolver
+
+class lazyslots(DictMixin):
+    #---------------------------------------------------------------------------
+    # dictionary of slots, where each value is only resolved (canonicalized, 
+    # date-parsed or decoded from the session attributes) on first access.
+    # Resolvers setting several keys (slot, slot.literal, slot.duration) are 
+    # evaluated once for all of them. Resolved values are stored, so the object
+    # behaves like a normal dict for handlers and store_session_slots.
+    # Note: errors and warnings of a resolver are logged on first access
+    #---------------------------------------------------------------------------
+    def __init__(self, context):
+        self._values = {}
+        self._pending = {}     # key -> (function, args) creating the value
+        self._context = context  # e.g. lang, timezone, passed to the resolvers
+
+    def AddPending(self, keys, function, *args):
+        #-----------------------------------------------------------------------
+        # registers 'function(slots, *args)' as the source of all 'keys'
+        # replaces existing values for these keys
+        #-----------------------------------------------------------------------
+        pending = (function, args)
+        for key in keys:
+            self._values.pop(key, None)
+            self._pending[key] = pending
+
+    def _resolve(self, key):
+        pending = self._pending[key]
+        (function, args) = pending
+        result = dict(self._context)
+        function(result, *args)
+        for pendingkey in [k for k in self._pending if self._pending[k] is pending]:
+            del self._pending[pendingkey]
+            if pendingkey in result: 
+                self._values[pendingkey] = result[pendingkey]
+
+    def __getitem__(self, key):
+        if key in self._pending: self._resolve(key)
+        return self._values[key]
+
+    def __setitem__(self, key, value):
+        self._pending.pop(key, None)
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        if key in self._pending: del self._pending[key]
+        else: del self._values[key]
+
+    def __contains__(self, key):
+        return key in self._values or key in self._pending
+
+    def has_key(self, key):
+        return key in self
+
+    def __iter__(self):
+        for key in self._values.keys(): yield key
+        for key in self._pending.keys(): yield key
+
+    def keys(self):
+        return self._values.keys() + self._pending.keys()
+
+    def __len__(self):
+        return len(self._values) + len(self._pending)
+
+    def GetPendingKeys(self):
+        # keys which have not been resolved yet
+        return self._pending.keys()
+
 #-------------------------------------------------------------------------------
 # 
-def parse_slots(intent, session, continue_session, input_locale, appdef):
+@myask_log.timed("parse_slots")
+def parse_slots(intent, session, continue_session, input_locale, appdef, lazy=False, timezone=None):
     #---------------------------------------------------------------------------
     # parse the slots from the intent structure 
     # and combine it with the session attributes if requested
@@ -307,61 +632,63 @@ def parse_slots(intent, session, continue_session, input_locale, appdef):
     # - continue_session: If True,session_attributes are used 
     # - input_locale: used to set locale and language correctly
     # - appdef
+    # - lazy: if True, a lazyslots object is returned, which resolves each 
+    #         slot on first access only
+    # - timezone: time zone name of the device (e.g. from the Alexa settings
+    #         API), None: time zone of the input locale
     # RETURN:
     # data structure with all application slots.
     # slots are provided as canonicals with an additional SLOTNAME.literal field
     #---------------------------------------------------------------------------
-    slots = {}
-    if input_locale in ["de-DE", "deu_deu"] : 
-        lang = "de-DE"
-        utc_offset = 1
+    if input_locale in LOCALES and appdef.IsSupportedLocale(LOCALES[input_locale][0]): 
+        (lang, localetimezone) = LOCALES[input_locale]
     else:
         myask_log.error("Unsupported input locale '"+ input_locale +"'")
         lang = input_locale
-        utc_offset = 0
+        localetimezone = "UTC"
+    if timezone is None: timezone = localetimezone
+    utc_offset = get_utc_offset(timezone)
 
+    if lazy: slots = lazyslots({'lang': lang, 'timezone': timezone, 'utc_offset': utc_offset})
+    else: slots = {}
     slots['lang'] = lang
+    slots['timezone'] = timezone
     slots['utc_offset'] = utc_offset
 
     if continue_session == True: 
         if  'attributes' in session: 
-            myask_log.debug(3, "SESSION_ATTRIBUTES: "+ str(session) )    
+            myask_log.debug(3, "SESSION_ATTRIBUTES: %s", session)    
             session_attributes = session['attributes']
             for sessionslot in session_attributes:
-                if re.match("DATE:\d\d\d\d-\d+-\d+$", session_attributes[sessionslot]): 
-                    tmp_str= session_attributes[sessionslot]
-                    slots[sessionslot] = datetime.strptime(tmp_str, "DATE:%Y-%m-%d").date()
-                else: slots[sessionslot] = session_attributes[sessionslot]
+                value = session_attributes[sessionslot]
+                if not lazy: 
+                    decode_session_attribute(slots, sessionslot, value)
+                elif isinstance(value, basestring) and value[:2] == "C:":
+                    slots.AddPending((sessionslot, sessionslot+".literal"), decode_session_attribute, sessionslot, value)
+                else:
+                    slots.AddPending((sessionslot,), decode_session_attribute, sessionslot, value)
         else:
             myask_log.error("SESSION_ATTRIBUTES: ERROR NO ATTRIBUTES FOUND \n"+ str(session) +"\nEND_SESSION_ATTRIBUTES")
 
     if 'slots' in intent:        
+        plan = _get_slot_plan(appdef, intent.get('name', ""))
         for inputslot in intent['slots']:
             if 'value' not in intent['slots'][inputslot]:
                 continue
-            if appdef.isApplicationSlot(inputslot):
-                literal = intent['slots'][inputslot]['value']
-                if appdef.getSlottype(inputslot) == "MY_RELATIVE_DATE": 
-                    canonical_date = appdef.GetSlotCanonical(inputslot,literal, strict=True)              
-                    (slots[inputslot],slots[inputslot+'.duration']) = readMyRelativeDate(canonical_date)
-                    slots[inputslot+'.literal'] = literal
-                elif appdef.getSlottype(inputslot) == "MY_YEARS": 
-                    canonical_date = appdef.GetSlotCanonical(inputslot,literal, strict=True)              
-                    (slots[inputslot],slots[inputslot+'.duration']) = readMyYear(canonical_date)
-                    slots[inputslot+'.literal'] = literal
-                elif appdef.getSlottype(inputslot) == "AMAZON.DATE":                
-                    (slots[inputslot],slots[inputslot+'.duration']) = readAmazonDate(literal)
-                    slots[inputslot+'.literal'] = literal
-                elif appdef.getSlottype(inputslot) == "AMAZON.NUMBER":
-                    slots[inputslot] = literal
-                elif appdef.getSlottype(inputslot) == "AMAZON.DE_FIRST_NAME":
-                    slots[inputslot] = literal
-                else:
-                    slots[inputslot] = appdef.GetSlotCanonical(inputslot,literal, strict=True)
-                    slots[inputslot+".literal"] = literal
+            if inputslot in plan: resolver = plan[inputslot]
+            else: resolver = _add_to_slot_plan(plan, appdef, inputslot)
+            if resolver is None:
+                continue
+            literal = intent['slots'][inputslot]['value']
+            if lazy and resolver in SLOT_RESOLVER_KEYS:
+                keys = [inputslot + suffix for suffix in SLOT_RESOLVER_KEYS[resolver]]
+                slots.AddPending(keys, resolver, inputslot, literal, appdef, lang)
+            else:
+                resolver(slots, inputslot, literal, appdef, lang)
     else:
         myask_log.debug(2, "No slots section found")
-    myask_log.debug(5, "SLOTS: "+ str(slots))    
+    if lazy: myask_log.debug(5, "SLOTS (lazy): %s", slots.keys())
+    else: myask_log.debug(5, "SLOTS: %s", slots)
     return slots
 
 def main():
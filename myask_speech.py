@@ -118,10 +118,12 @@ def bestPhoneticMatch(searchstr, choices, maxdistance):
     bestmatch = ""
     
     searchphon = encode_cgnph(searchstr)
+    debugging = myask_log.IsDebugEnabled(9)
     for checkstring in choices:
         checkphon = encode_cgnph(checkstring)
         d = levenshtein(searchphon, checkphon)
-        myask_log.debug(9, "phonetic Dist : " + str(d) +" = "+ searchstr+ "("+searchphon+ ") - " +checkstring+"("+checkphon+")")
+        if debugging: 
+            myask_log.debug(9, "phonetic Dist : %d = %s(%s) - %s(%s)", d, searchstr, searchphon, checkstring, checkphon)
         if d < mindistance :
             mindistance = d
             bestmatch = checkstring
@@ -131,7 +133,7 @@ def bestPhoneticMatch(searchstr, choices, maxdistance):
                 bestmatch = checkstring
 
         
-    myask_log.debug(9, "BEST match: '"+bestmatch+"'")
+    myask_log.debug(9, "BEST match: '%s'", bestmatch)
     return bestmatch
     
 def main():